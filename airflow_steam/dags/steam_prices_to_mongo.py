@@ -0,0 +1,53 @@
+from data_pipeline.pipeline_bronze import fetch_and_store_app_prices, probe_parked_apps
+from data_pipeline.managers.steam_api_manager import SteamAPIManager
+from data_pipeline.managers.mongo_manager import MongoManager
+from airflow import DAG
+from airflow.operators.python import PythonOperator
+from airflow.operators.latest_only import LatestOnlyOperator
+from datetime import datetime, timedelta
+
+
+default_args = {
+    'owner': 'airflow',
+    'start_date': datetime(2025, 6, 3),
+    'retries': 3,
+    'retry_delay': timedelta(seconds=30),
+    'depend_on_past': True
+}
+
+steam_api_manager = SteamAPIManager()
+mongo_manager = MongoManager()
+
+with DAG(
+    dag_id='steam_prices_to_mongo',
+    default_args=default_args,
+    description='Refresh prices of Steam apps and probe parked apps in MongoDB',
+    schedule="30 */3 * * *",
+    catchup=False,
+    max_active_runs=1,
+) as dag:
+
+    latest_only = LatestOnlyOperator(task_id='latest_only')
+
+    # Batched appdetails requests filtered to price_overview
+    fetch_app_prices = PythonOperator(
+        task_id='fetch_app_prices',
+        python_callable=fetch_and_store_app_prices,
+        op_kwargs={
+            'steam_api_manager': steam_api_manager,
+            'mongo_manager': mongo_manager,
+        }
+    )
+
+    # The same cheap requests tell whether parked apps got a store page again
+    probe_parked = PythonOperator(
+        task_id='probe_parked_apps',
+        python_callable=probe_parked_apps,
+        op_kwargs={
+            'steam_api_manager': steam_api_manager,
+            'mongo_manager': mongo_manager,
+        }
+    )
+
+    # Define the task dependencies
+    latest_only >> fetch_app_prices >> probe_parked
@@ -1,9 +1,8 @@
 from data_pipeline.pipeline_bronze import (
     fetch_and_store_app_names,
     get_filtered_appids,
-    fetch_and_store_app_details,
-    fetch_and_store_app_tags,
-    fetch_and_store_app_reviews,
+    create_crawl_shards,
+    crawl_shards,
 )
 from data_pipeline.managers.steam_api_manager import SteamAPIManager
 from data_pipeline.managers.mongo_manager import MongoManager
@@ -12,6 +11,7 @@ from airflow.operators.python import PythonOperator
 from airflow.operators.latest_only import LatestOnlyOperator
 from airflow.operators.trigger_dagrun import TriggerDagRunOperator
 from datetime import datetime, timedelta
+import os
 
 
 default_args = {
@@ -22,6 +22,9 @@ default_args = {
     'depend_on_past': True
 }
 
+# Crawl workers per endpoint, all sharing the per-host rate budgets
+CRAWL_WORKERS = int(os.getenv('STEAM_CRAWL_WORKERS', 4))
+
 steam_api_manager = SteamAPIManager()
 mongo_manager = MongoManager()
 
@@ -49,40 +52,44 @@ with DAG(
         task_id='filtered_appids',
         python_callable=get_filtered_appids,
         op_kwargs={
-            'steam_api_manager': steam_api_manager, 
             'mongo_manager': mongo_manager
         }
     )
 
-    fetch_app_details = PythonOperator(
-        task_id='fetch_app_details',
-        python_callable=fetch_and_store_app_details,
+    create_shards = PythonOperator(
+        task_id='create_crawl_shards',
+        python_callable=create_crawl_shards,
         op_kwargs={
-            'steam_api_manager': steam_api_manager, 
-            'mongo_manager': mongo_manager, 
+            'mongo_manager': mongo_manager,
             'appids': filtered_appids.output
         }
     )
 
-    fetch_app_tags = PythonOperator(
+    # Parallel workers per endpoint claiming shards through Mongo leases
+    fetch_app_details = PythonOperator.partial(
+        task_id='fetch_app_details',
+        python_callable=crawl_shards,
+    ).expand(op_kwargs=[
+        {'endpoint': 'details', 'worker_index': index}
+        for index in range(CRAWL_WORKERS)
+    ])
+
+    fetch_app_tags = PythonOperator.partial(
         task_id='fetch_app_tags',
-        python_callable=fetch_and_store_app_tags,
-        op_kwargs={
-            'steam_api_manager': steam_api_manager, 
-            'mongo_manager': mongo_manager, 
-            'appids': filtered_appids.output
-        }
-    )
+        python_callable=crawl_shards,
+    ).expand(op_kwargs=[
+        {'endpoint': 'tags', 'worker_index': index}
+        for index in range(CRAWL_WORKERS)
+    ])
 
-    fetch_app_reviews = PythonOperator(
+    fetch_app_reviews = PythonOperator.partial(
         task_id='fetch_app_reviews',
-        python_callable=fetch_and_store_app_reviews,
-        op_kwargs={
-            'steam_api_manager': steam_api_manager, 
-            'mongo_manager': mongo_manager, 
-            'appids': filtered_appids.output
-        }
-    )
+        python_callable=crawl_shards,
+    ).expand(op_kwargs=[
+        # 'json' pages through the JSON reviews instead of the store review page
+        {'endpoint': 'reviews', 'worker_index': index, 'fetch_kwargs': {'mode': os.getenv('STEAM_REVIEWS_MODE', 'html')}}
+        for index in range(CRAWL_WORKERS)
+    ])
     
     trigger_mongo_to_postgres = TriggerDagRunOperator(
         task_id='trigger_mongo_to_postgres',
@@ -94,6 +101,7 @@ with DAG(
         latest_only 
         >> fetch_app_names
         >> filtered_appids
+        >> create_shards
         >> [fetch_app_details, fetch_app_tags, fetch_app_reviews]
         >> trigger_mongo_to_postgres
     )
\ No newline at end of file
@@ -0,0 +1,53 @@
+"""
+Compare the column-wise cleaning functions of `utils_pipeline` with the
+per-value implementations they replace, on synthetic Steam-like data.
+
+    python -m benchmarks.bench_utils_pipeline
+"""
+import random
+import time
+
+import polars as pl
+
+from data_pipeline.utils.utils_pipeline import (
+    is_diff_texts,
+    is_diff_texts_df,
+    remove_html_tags,
+    remove_html_tags_series,
+)
+
+# Markup of a typical store description
+DESCRIPTION_FRAGMENTS = [
+    "<br>", "<br />", "<li>", "</li>", '<ul class="bb_ul">', "</ul>", "<p>", "</p>", "<strong>", "</strong>",
+    '<h2 class="bb_tag">', "</h2>", '<img src="https://x/y.gif?t=1">', '<a href="https://store.steampowered.com/">', "</a>",
+    "&amp;", "&quot;", "&nbsp;", "&reg;", "&trade;", "\n", " ", "Hello", "world", "Ünïcödé", "OS:", "Windows 10",
+]
+
+
+def timed(func, *args) -> float:
+    started_at = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - started_at
+
+
+def bench_remove_html_tags(rows: int = 2000, fragments: int = 400) -> None:
+    rng = random.Random(0)
+    series = pl.Series(["".join(rng.choices(DESCRIPTION_FRAGMENTS, k=fragments)) for _ in range(rows)])
+    baseline = timed(lambda: [remove_html_tags(text) for text in series])
+    vectorized = timed(remove_html_tags_series, series)
+    print(f"remove_html_tags: {rows} rows - BeautifulSoup {baseline:.2f}s, column-wise {vectorized:.3f}s ({baseline / vectorized:.0f}x)")
+
+
+def bench_is_diff_texts(rows: int = 50, lines: int = 3000) -> None:
+    # Long descriptions differing in most lines, the worst case of ndiff
+    about = "\n".join(f"line {i} of the description" for i in range(lines))
+    detailed = "\n".join(f"line {i} of the description" for i in range(lines, 0, -1))
+    df = pl.LazyFrame({'about_the_game': [about] * rows, 'detailed_description': [detailed] * rows})
+    baseline = timed(lambda: [is_diff_texts(about, detailed) for _ in range(rows)])
+    vectorized = timed(lambda: df.pipe(is_diff_texts_df, a='about_the_game', b='detailed_description', alias='desc_has_diff').collect())
+    print(f"is_diff_texts: {rows} rows of {lines} lines - difflib {baseline:.2f}s, column-wise {vectorized:.3f}s ({baseline / vectorized:.0f}x)")
+
+
+if __name__ == "__main__":
+    bench_remove_html_tags()
+    bench_is_diff_texts()
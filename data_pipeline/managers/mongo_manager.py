@@ -1,107 +1,899 @@
 import os
+import re
+import zlib
+import time
+import asyncio
 import logging
-from pymongo import MongoClient, UpdateOne
-from datetime import datetime
+import threading
+from collections import defaultdict
+import hashlib
+from more_itertools import chunked
+from typing import Iterable
+from pymongo import MongoClient, UpdateOne, DeleteOne, ReturnDocument
+from bson.binary import Binary, USER_DEFINED_SUBTYPE
+from datetime import datetime, timedelta
+from data_pipeline.utils.utils_crawl import content_hash, estimate_refresh_interval
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 
 logger = logging.getLogger("MongoManager")
 
+# Endpoints fetched per app and tracked by the crawl frontier
+FRONTIER_ENDPOINTS = ['details', 'tags', 'reviews']
+# Refresh interval of an endpoint before its change rate is known
+FRONTIER_REFRESH_INTERVAL = timedelta(days=14)
+# Bounds of the refresh interval learned per app and endpoint as (floor, ceiling)
+FRONTIER_REFRESH_BOUNDS = {
+    'details': (timedelta(days=1), timedelta(days=60)),
+    'tags': (timedelta(days=3), timedelta(days=90)),
+    'reviews': (timedelta(hours=12), timedelta(days=30)),
+}
+# Number of refetch outcomes kept per app and endpoint to estimate its change rate
+FRONTIER_HISTORY_SIZE = 16
+
+# Negative cache of apps without details: the retry delay doubles from the
+# base after every failure, and apps are parked after the maximum tries
+NO_DETAILS_RETRY_BASE = timedelta(days=1)
+NO_DETAILS_MAX_TRIES = 6
+# How often a parked app is probed for a store page
+NO_DETAILS_PROBE_INTERVAL = timedelta(days=30)
+# How long a claimed crawl shard stays leased without a heartbeat
+CRAWL_LEASE_DURATION = timedelta(minutes=5)
+# Claims of a shard before it is given up as failed
+CRAWL_LEASE_MAX_ATTEMPTS = 3
+# Time a change may take from being stamped by the server to being readable,
+# kept well above the flush interval of `MongoBulkWriter`
+STAGE_WATERMARK_MARGIN = timedelta(minutes=1)
+# Priority of apps first seen by the names sync, above apps missing every endpoint
+FRONTIER_NEW_APP_PRIORITY = len(FRONTIER_ENDPOINTS) + 1
+
+# Raw HTML fragments of 'reviews' stored compressed when they exceed the threshold (in bytes)
+COMPRESSED_REVIEW_FIELDS = ['html', 'review_score']
+COMPRESSION_THRESHOLD = 4096
+# Codec tag prefixed to every compressed blob
+ZLIB_TAG, ZSTD_TAG = b'\x01', b'\x02'
+
+PLAYTEST_PATTERN = re.compile(r"\bplaytest\b", re.IGNORECASE)
+
+def hash_name(name: str) -> str:
+    """Short stable hash of an app name used to detect renames"""
+    return hashlib.blake2b(name.encode('utf-8'), digest_size=8).hexdigest()
+
+def compress_blob(text: str) -> Binary:
+    """Compress a string into tagged BSON binary, with zstd when installed"""
+    raw = text.encode('utf-8')
+    if zstandard is not None:
+        return Binary(ZSTD_TAG + zstandard.ZstdCompressor(level=6).compress(raw), USER_DEFINED_SUBTYPE)
+    return Binary(ZLIB_TAG + zlib.compress(raw, 6), USER_DEFINED_SUBTYPE)
+
+def decompress_blob(value):
+    """Inverse of `compress_blob`, any other value is returned as is"""
+    if not isinstance(value, Binary) or value.subtype != USER_DEFINED_SUBTYPE:
+        return value
+    tag, data = value[:1], value[1:]
+    if tag == ZLIB_TAG:
+        return zlib.decompress(data).decode('utf-8')
+    if tag == ZSTD_TAG:
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read zstd compressed blobs")
+        return zstandard.ZstdDecompressor().decompress(data).decode('utf-8')
+    raise ValueError(f"Unknown compressed blob tag: {tag!r}")
+
 class MongoManager:
     """Handle MongoDB operations"""
     
-    def __init__(self, connection_string=os.getenv('MONGODB_CONNECTION_STRING')):
+    def __init__(
+        self,
+        connection_string=os.getenv('MONGODB_CONNECTION_STRING'),
+        refresh_bounds: dict = None,
+        compress_reviews: bool = os.getenv('MONGODB_COMPRESS_REVIEWS', '').lower() in ('1', 'true'),
+        compression_threshold: int = COMPRESSION_THRESHOLD,
+    ):
         self.connection_string = connection_string
         self.client = MongoClient(self.connection_string)
         self.database = self.client['steam_db']
+        self.refresh_bounds = {**FRONTIER_REFRESH_BOUNDS, **(refresh_bounds or {})}
+        self.compress_reviews = compress_reviews
+        self.compression_threshold = compression_threshold
+        self.compression_stats = {'fields': 0, 'raw_bytes': 0, 'stored_bytes': 0}
+        self._compression_lock = threading.Lock()
 
     def upsert_app_names(self, app_names: dict):
-        """Upsert of app names into 'names' collection"""
+        """Sync 'names' collection with a fully loaded app list"""
+        apps = app_names['applist']['apps'] if app_names else []
+        self.sync_app_names([apps])
+
+    def sync_app_names(self, app_chunks: Iterable[list]):
+        """
+        Sync 'names' collection with the app list streamed in chunks,
+        writing only new, renamed and removed apps, one bulk write per chunk
+        """
         collection = self.database['names']
-        operations = [
-            UpdateOne(
-                {'appid': app['appid']},
-                {   
-                    '$set': {
-                        'name': app['name'],
-                        'updated_at': datetime.now()
+        now = datetime.now()
+        # Compact snapshot of the collection: appid -> (name hash, is removed)
+        stored = {
+            doc['appid']: (doc.get('name_hash'), 'removed_at' in doc)
+            for doc in collection.find({}, {'_id': 0, 'appid': 1, 'name_hash': 1, 'removed_at': 1})
+        }
+
+        seen = set()
+        inserted = renamed = restored = unchanged = 0
+        for apps in app_chunks:
+            operations = []
+            frontier_appids = []
+            for app in apps:
+                appid = app['appid']
+                # The app list contains some appids more than once
+                if appid in seen:
+                    continue
+                seen.add(appid)
+                name_hash = hash_name(app['name'])
+
+                if appid not in stored:
+                    inserted += 1
+                    if not PLAYTEST_PATTERN.search(app['name']):
+                        frontier_appids.append(appid)
+                    operations.append(UpdateOne(
+                        {'appid': appid},
+                        {
+                            '$set': {'name': app['name'], 'name_hash': name_hash, 'updated_at': now},
+                            '$setOnInsert': {'first_seen_at': now},
+                        },
+                        upsert=True
+                    ))
+                    continue
+
+                stored_hash, is_removed = stored[appid]
+                if stored_hash == name_hash and not is_removed:
+                    unchanged += 1
+                else:
+                    renamed += stored_hash != name_hash
+                    restored += is_removed
+                    if is_removed and not PLAYTEST_PATTERN.search(app['name']):
+                        frontier_appids.append(appid)
+                    operations.append(UpdateOne(
+                        {'appid': appid},
+                        {
+                            '$set': {'name': app['name'], 'name_hash': name_hash, 'updated_at': now},
+                            '$unset': {'removed_at': ''},
+                        }
+                    ))
+            if operations:
+                collection.bulk_write(operations, ordered=False)
+            if frontier_appids:
+                self.seed_frontier(frontier_appids, now)
+
+        if not seen:
+            # An empty list is a failed fetch, not every app being removed
+            logger.warning("No app names to upsert")
+            return
+
+        # Apps no longer listed are flagged instead of deleted
+        removed = [appid for appid, (_, is_removed) in stored.items() if appid not in seen and not is_removed]
+        for batch in chunked(removed, 10000):
+            collection.update_many({'appid': {'$in': batch}}, {'$set': {'removed_at': now}})
+            self.database['frontier'].delete_many({'appid': {'$in': batch}})
+
+        logger.info(
+            f"Synced app names - Total: {len(seen)}, "
+            f"Inserted: {inserted}, "
+            f"Renamed: {renamed}, "
+            f"Restored: {restored}, "
+            f"Removed: {len(removed)}, "
+            f"Unchanged: {unchanged}"
+        )
+
+    # -----------------------
+    # Write Operations
+    # -----------------------
+    def app_details_operations(
+        self,
+        appid: int,
+        app_details: dict,
+        no_details_doc: dict = None,
+        previous_hash: str = None,
+    ) -> list[tuple[str, UpdateOne]]:
+        """Build the writes of app details into 'details' or 'no_details'"""
+        str_appid = str(appid)
+
+        if str_appid in app_details and 'data' in app_details[str_appid] and app_details[str_appid]['data']:
+            operations = self._content_operations('details', appid, app_details[str_appid]['data'], previous_hash)
+            # The app got a store page since it was negatively cached
+            if no_details_doc:
+                operations.append(('no_details', DeleteOne({'appid': appid})))
+            return operations
+
+        # Log missing details and push back the next retry
+        tries, next_retry_at, is_parked = self.no_details_backoff(no_details_doc)
+        update = {
+            '$setOnInsert': {'appid': appid},
+            '$set': {'tries': tries, 'last_tried_at': datetime.now(), 'next_retry_at': next_retry_at},
+        }
+        if is_parked:
+            update['$set']['parked_at'] = datetime.now()
+        return [('no_details', UpdateOne({'appid': appid}, update, upsert=True))]
+
+    def no_details_backoff(self, no_details_doc: dict = None) -> tuple[int, datetime, bool]:
+        """Tries, next retry time and whether to park an app after one more failure"""
+        tries = (no_details_doc or {}).get('tries', 0) + 1
+        # Counters written before apps were parked can be far above the maximum
+        next_retry_at = datetime.now() + NO_DETAILS_RETRY_BASE * 2 ** (min(tries, NO_DETAILS_MAX_TRIES) - 1)
+        return tries, next_retry_at, tries >= NO_DETAILS_MAX_TRIES
+
+    def load_no_details(self, appids: list) -> dict:
+        """Negative cache documents of `appids` keyed by appid"""
+        cursor = self.database['no_details'].find({'appid': {'$in': appids}}, {'_id': 0})
+        return {doc['appid']: doc for doc in cursor}
+
+    def app_tags_operations(self, appid: int, app_tags: dict, previous_hash: str = None) -> list[tuple[str, UpdateOne]]:
+        """Build the write of app tags into 'tags'"""
+        return self._content_operations('tags', appid, app_tags, previous_hash)
+
+    def app_reviews_operations(self, appid: int, app_reviews: dict, previous_hash: str = None) -> list[tuple[str, UpdateOne]]:
+        """Build the write of app reviews into 'reviews'"""
+        transform = self.compress_review_fields if self.compress_reviews else None
+        return self._content_operations('reviews', appid, app_reviews, previous_hash, transform)
+
+    def _content_operations(
+        self,
+        collection_name: str,
+        appid: int,
+        content: dict,
+        previous_hash: str = None,
+        transform=None,
+    ) -> list[tuple[str, UpdateOne]]:
+        """
+        Build the write of a fetched payload along with its content hash.
+        A payload identical to the stored one is not written at all, so
+        'content_changed_at' only moves when the content does, and is stamped
+        by the server when the write lands. `transform` rewrites the payload
+        for storage after it was hashed.
+        """
+        new_hash = content_hash(content)
+        if new_hash == previous_hash:
+            return []
+        if transform:
+            content = transform(content)
+        return [(collection_name, UpdateOne(
+            {'appid': appid},
+            {'$set': {**content, 'content_hash': new_hash}, '$currentDate': {'content_changed_at': True}},
+            upsert=True
+        ))]
+
+    def compress_review_fields(self, app_reviews: dict) -> dict:
+        """Compress the raw HTML fields of a reviews payload above the threshold"""
+        app_reviews = dict(app_reviews)
+        for field in COMPRESSED_REVIEW_FIELDS:
+            value = app_reviews.get(field)
+            if not isinstance(value, str):
+                continue
+            raw_bytes = len(value.encode('utf-8'))
+            if raw_bytes < self.compression_threshold:
+                continue
+            blob = compress_blob(value)
+            # Incompressible fragments stay plain strings
+            if len(blob) >= raw_bytes:
+                continue
+            app_reviews[field] = blob
+            with self._compression_lock:
+                self.compression_stats['fields'] += 1
+                self.compression_stats['raw_bytes'] += raw_bytes
+                self.compression_stats['stored_bytes'] += len(blob)
+        return app_reviews
+
+    def compression_summary(self) -> dict:
+        """Compressed fields so far and their compression ratio"""
+        stats = dict(self.compression_stats)
+        stats['ratio'] = round(stats['raw_bytes'] / stats['stored_bytes'], 2) if stats['stored_bytes'] else None
+        return stats
+
+    def load_content_hashes(self, collection_name: str, appids: list) -> dict:
+        """Content hashes of the stored documents of `appids` keyed by appid"""
+        cursor = self.database[collection_name].find(
+            {'appid': {'$in': appids}, 'content_hash': {'$exists': True}},
+            {'_id': 0, 'appid': 1, 'content_hash': 1}
+        )
+        return {doc['appid']: doc['content_hash'] for doc in cursor}
+
+    def app_prices_operations(self, app_prices: dict) -> list[tuple[str, UpdateOne]]:
+        """Build the writes of only 'price_overview' of apps already in 'details'"""
+        now = datetime.now()
+        operations = []
+        for str_appid, result in app_prices.items():
+            if not result or not result.get('success'):
+                continue
+            # Apps without a price (e.g. free) return an empty list as data
+            data = result.get('data')
+            price_overview = data.get('price_overview') if isinstance(data, dict) else None
+            # Only apps whose price actually changed match, so nothing else is rewritten.
+            # The stored content no longer matches its hash, which is dropped so the
+            # next details fetch is written even if it equals the previous payload
+            if price_overview:
+                operations.append(('details', UpdateOne(
+                    {'appid': int(str_appid), 'price_overview': {'$ne': price_overview}},
+                    {
+                        '$set': {'price_overview': price_overview, 'price_updated_at': now},
+                        '$unset': {'content_hash': ''},
+                        '$currentDate': {'content_changed_at': True},
                     }
-                },
-                upsert=True
-            )
-            for app in app_names['applist']['apps']
-        ]
-        if operations:
-            result = collection.bulk_write(operations)
-            logger.info(
-                f"Upserted app names - Total: {len(operations)}, "
-                f"Unchanged: {result.matched_count}, "
-                f"Updated: {result.modified_count}, "
-                f"Inserted: {result.upserted_count}"
-            )
+                )))
+            else:
+                operations.append(('details', UpdateOne(
+                    {'appid': int(str_appid), 'price_overview': {'$exists': True}},
+                    {
+                        '$unset': {'price_overview': '', 'content_hash': ''},
+                        '$set': {'price_updated_at': now},
+                        '$currentDate': {'content_changed_at': True},
+                    }
+                )))
+        return operations
+
+    def bulk_writer(self, batch_size: int = 500, flush_interval: float = 5.0, metrics=None) -> 'MongoBulkWriter':
+        """Buffered writer that flushes the operations above as unordered bulk writes"""
+        return MongoBulkWriter(self.database, batch_size=batch_size, flush_interval=flush_interval, metrics=metrics)
+
+    def _write_one(self, collection_name: str, operation: UpdateOne, label: str, appid: int):
+        result = self.database[collection_name].bulk_write([operation])
+        if result.upserted_count:
+            logger.info(f"[INSERTED] {label} for AppID {appid}")
+        elif result.modified_count > 0:
+            logger.info(f"[UPDATED] {label} for AppID {appid}")
         else:
-            logger.warning("No app names to upsert")
+            logger.info(f"[UNCHANGED] {label} for AppID {appid}")
 
     def upsert_app_details(self, appid: int, app_details: dict):
         """Upsert of app details into 'details' or 'no_details'"""
-        collection = self.database['details']
-        str_appid = str(appid)
+        no_details_doc = self.database['no_details'].find_one({'appid': appid})
+        previous_hash = self.load_content_hashes('details', [appid]).get(appid)
+        for collection_name, operation in self.app_details_operations(appid, app_details, no_details_doc, previous_hash):
+            label = 'Details' if collection_name == 'details' else 'No Details'
+            self._write_one(collection_name, operation, label, appid)
 
-        if str_appid in app_details and 'data' in app_details[str_appid] and app_details[str_appid]['data']:
-            result = collection.update_one(
+    def upsert_app_prices(self, app_prices: dict):
+        """Update only 'price_overview' of apps already in 'details' collection"""
+        with self.bulk_writer() as writer:
+            for collection_name, operation in self.app_prices_operations(app_prices):
+                writer.add(collection_name, operation)
+        if not writer.operations:
+            logger.warning("No app prices to refresh")
+
+    def upsert_app_tags(self, appid: int, app_tags: dict):
+        """Upsert of app tags into 'tags' collection"""
+        previous_hash = self.load_content_hashes('tags', [appid]).get(appid)
+        for collection_name, operation in self.app_tags_operations(appid, app_tags, previous_hash):
+            self._write_one(collection_name, operation, 'Tags', appid)
+
+    def upsert_app_reviews(self, appid: int, app_reviews: dict):
+        """Upsert of app reviews into 'reviews' collection"""
+        previous_hash = self.load_content_hashes('reviews', [appid]).get(appid)
+        for collection_name, operation in self.app_reviews_operations(appid, app_reviews, previous_hash):
+            self._write_one(collection_name, operation, 'Reviews', appid)
+
+    def begin_stage(self, stage: str, collection_name: str) -> dict:
+        """
+        Start a staging run reading `collection_name` and return the filter
+        of the documents whose content changed since the last committed run.
+
+        The next watermark is taken from the server clock that stamps
+        'content_changed_at', minus a margin for writes still in flight,
+        so changes landing while the run reads are staged again next time.
+        """
+        self.database[collection_name].create_index('content_changed_at')
+        watermark = self.get_crawl_state(f"stage:{stage}").get('watermark')
+        margin_ms = STAGE_WATERMARK_MARGIN // timedelta(milliseconds=1)
+        self.database['crawl_state'].update_one(
+            {'_id': f"stage:{stage}"},
+            [{'$set': {'pending_at': {'$subtract': ['$$NOW', margin_ms]}, 'updated_at': '$$NOW'}}],
+            upsert=True
+        )
+        return {'content_changed_at': {'$gt': watermark}} if watermark else {}
+
+    def commit_stage(self, stage: str):
+        """Mark the changes seen when the staging run began as processed"""
+        pending_at = self.get_crawl_state(f"stage:{stage}").get('pending_at')
+        if pending_at:
+            self.set_crawl_state(f"stage:{stage}", {'watermark': pending_at})
+
+    def get_crawl_state(self, key: str) -> dict:
+        """Read a state document of the crawler from 'crawl_state' collection"""
+        return self.database['crawl_state'].find_one({'_id': key}, {'_id': 0}) or {}
+
+    def set_crawl_state(self, key: str, values: dict):
+        """Persist a state document of the crawler into 'crawl_state' collection"""
+        self.database['crawl_state'].update_one(
+            {'_id': key},
+            {'$set': {**values, 'updated_at': datetime.now()}},
+            upsert=True
+        )
+
+
+    # -----------------------
+    # Crawl Frontier
+    # -----------------------
+    def ensure_frontier_indexes(self):
+        collection = self.database['frontier']
+        collection.create_index('appid', unique=True)
+        # Equality/sort/range order: highest priority first, then longest overdue
+        collection.create_index([('priority', -1), ('next_due_at', 1)])
+        # Parked apps of the negative cache, least recently probed first
+        self.database['no_details'].create_index('appid', unique=True)
+        self.database['no_details'].create_index([('parked_at', 1), ('last_probed_at', 1)])
+
+    def seed_frontier(self, appids: list, now: datetime):
+        """Add newly listed apps to 'frontier' ahead of everything else"""
+        operations = [
+            UpdateOne(
                 {'appid': appid},
-                {'$set': app_details[str_appid]['data']},
+                {'$setOnInsert': {
+                    'appid': appid,
+                    'pending': FRONTIER_ENDPOINTS,
+                    'priority': FRONTIER_NEW_APP_PRIORITY,
+                    'next_due_at': now,
+                    'first_seen_at': now,
+                }},
                 upsert=True
             )
-            if result.upserted_id:
-                logger.info(f"[INSERTED] Details for AppID {appid}")
-            elif result.modified_count > 0:
-                logger.info(f"[UPDATED] Details for AppID {appid}")
-            else:
-                logger.info(f"[UNCHANGED] Details for AppID {appid}")
-        else:
-            # Log missing details
-            no_details_col = self.database['no_details']
-            result = no_details_col.update_one(
-                {'appid': appid},
+            for appid in appids
+        ]
+        self.database['frontier'].bulk_write(operations, ordered=False)
+
+    def rebuild_frontier(self):
+        """
+        Build 'frontier' by scanning 'names' and the fetched collections once.
+        Only apps missing from it are added, so apps already seeded or
+        scheduled keep their state. Needed once, then marked in 'crawl_state'.
+        """
+        names = self.database['names'].find(
+            {
+                'name': {'$not': {'$regex': PLAYTEST_PATTERN.pattern, '$options': 'i'}},
+                'removed_at': {'$exists': False},
+            },
+            {'_id': 0, 'appid': 1, 'first_seen_at': 1}
+        )
+        fetched = {
+            'details': {doc['appid'] for doc in self.database['details'].find({}, {'_id': 0, 'appid': 1})}
+                | {doc['appid'] for doc in self.database['no_details'].find({}, {'_id': 0, 'appid': 1})},
+            'tags': {doc['appid'] for doc in self.database['tags'].find({}, {'_id': 0, 'appid': 1})},
+            'reviews': {doc['appid'] for doc in self.database['reviews'].find({}, {'_id': 0, 'appid': 1})},
+        }
+
+        now = datetime.now()
+        total = 0
+        for batch in chunked(names, 10000):
+            operations = []
+            for doc in batch:
+                pending = [endpoint for endpoint in FRONTIER_ENDPOINTS if doc['appid'] not in fetched[endpoint]]
+                operations.append(UpdateOne(
+                    {'appid': doc['appid']},
+                    {'$setOnInsert': {
+                        'pending': pending,
+                        'priority': len(pending),
+                        'next_due_at': now,
+                        'first_seen_at': doc.get('first_seen_at'),
+                    }},
+                    upsert=True
+                ))
+            result = self.database['frontier'].bulk_write(operations, ordered=False)
+            total += result.upserted_count
+        self.set_crawl_state('frontier', {'built_at': now})
+        logger.info(f"Rebuilt frontier, added {total} apps")
+
+    def select_due_appids(self, limit: int = 1000) -> list:
+        """Next due appids, highest priority and longest overdue first"""
+        cursor = (
+            self.database['frontier']
+            .find({'next_due_at': {'$lte': datetime.now()}}, {'_id': 0, 'appid': 1})
+            .sort([('priority', -1), ('next_due_at', 1)])
+            .limit(limit)
+        )
+        return [doc['appid'] for doc in cursor]
+
+    def load_frontier(self, appids: list) -> dict:
+        """Frontier documents of `appids` keyed by appid"""
+        cursor = self.database['frontier'].find({'appid': {'$in': appids}}, {'_id': 0})
+        return {doc['appid']: doc for doc in cursor}
+
+    def filter_due_appids(self, appids: list, endpoint: str, frontier: dict) -> list:
+        """Keep the appids whose `endpoint` is pending or due for a refresh"""
+        now = datetime.now()
+        due_appids = []
+        for appid in appids:
+            doc = frontier.get(appid)
+            schedule = (doc or {}).get('schedule', {}).get(endpoint)
+            deferred_until = (doc or {}).get('deferred', {}).get(endpoint)
+            if deferred_until and deferred_until > now:
+                continue
+            # Parked endpoints wait for a probe to revive them
+            if schedule and schedule.get('parked_at'):
+                continue
+            if doc is None or endpoint in doc.get('pending', []) or not schedule or schedule['due_at'] <= now:
+                due_appids.append(appid)
+        return due_appids
+
+    def defer_frontier_appids(self, appids: list, endpoint: str, until: datetime):
+        """Hold back `endpoint` of apps that could not be fetched (e.g. open circuit) until `until`"""
+        result = self.database['frontier'].update_many(
+            # Parked apps have no due date to push back
+            {'appid': {'$in': appids}, 'next_due_at': {'$ne': None}},
+            {'$set': {f'deferred.{endpoint}': until}, '$max': {'next_due_at': until}}
+        )
+        logger.info(f"Deferred {endpoint} of {result.modified_count} apps until {until}")
+
+    def frontier_fetched_operation(
+        self,
+        appid: int,
+        endpoint: str,
+        payload,
+        frontier_doc: dict = None,
+        due_at: datetime = None,
+        is_parked: bool = False,
+    ) -> tuple[str, UpdateOne]:
+        """
+        Build the 'frontier' update recording a completed fetch of `endpoint`:
+        whether the content changed since the previous fetch, and when the
+        endpoint is due again given the change rate this history implies.
+
+        `due_at` overrides that estimate (e.g. the negative cache retry time).
+        A parked endpoint is left out of the app's due date until its own next
+        fetch or a probe clears it, other endpoints keep their schedule.
+        """
+        now = datetime.now()
+        previous = ((frontier_doc or {}).get('schedule') or {}).get(endpoint) or {}
+        payload_hash = content_hash(payload)
+
+        history = list(previous.get('history', []))
+        if previous.get('hash') and previous.get('fetched_at'):
+            history.append({
+                'seconds': (now - previous['fetched_at']).total_seconds(),
+                'changed': payload_hash != previous['hash'],
+            })
+        history = history[-FRONTIER_HISTORY_SIZE:]
+
+        floor, ceiling = self.refresh_bounds[endpoint]
+        interval = estimate_refresh_interval(history, floor, ceiling, FRONTIER_REFRESH_INTERVAL)
+        schedule = {
+            'hash': payload_hash,
+            'fetched_at': now,
+            'history': history,
+            'interval_seconds': interval.total_seconds(),
+            'due_at': due_at or now + interval,
+        }
+        if is_parked:
+            schedule['parked_at'] = now
+        # $min skips nulls, so an app with every endpoint parked has no due date
+        next_due_at = {
+            '$cond': [
+                {'$gt': [{'$size': '$pending'}, 0]},
+                now,
+                {'$min': [
+                    {'$cond': [{'$ifNull': [f'$schedule.{name}.parked_at', False]}, None, f'$schedule.{name}.due_at']}
+                    for name in FRONTIER_ENDPOINTS
+                ]},
+            ]
+        }
+
+        return 'frontier', UpdateOne(
+            {'appid': appid},
+            [
+                {'$set': {
+                    'pending': {'$setDifference': [{'$ifNull': ['$pending', []]}, [endpoint]]},
+                    f'schedule.{endpoint}': {'$literal': schedule},
+                }},
+                # The app stays due until every endpoint was fetched once,
+                # then it is due when its first endpoint is
+                {'$set': {
+                    'priority': {'$size': '$pending'},
+                    'next_due_at': next_due_at,
+                }},
+            ],
+            upsert=True
+        )
+
+    def select_parked_appids(self, limit: int = 1000) -> list:
+        """Parked apps of the negative cache that were not probed recently"""
+        cursor = (
+            self.database['no_details']
+            .find(
                 {
-                    '$setOnInsert': {'appid': appid},
-                    '$inc': {'tries': 1},
+                    'parked_at': {'$exists': True},
+                    '$or': [
+                        {'last_probed_at': {'$exists': False}},
+                        {'last_probed_at': {'$lte': datetime.now() - NO_DETAILS_PROBE_INTERVAL}},
+                    ],
                 },
-                upsert=True
+                {'_id': 0, 'appid': 1}
             )
-            if result.upserted_id:
-                logger.info(f"[INSERTED] No Details for AppID {appid}")
-            elif result.modified_count > 0:
-                logger.info(f"[UPDATED] No Details for AppID {appid}")
+            .sort('last_probed_at', 1)
+            .limit(limit)
+        )
+        return [doc['appid'] for doc in cursor]
+
+    def parked_probe_operations(self, app_results: dict) -> list[tuple[str, UpdateOne]]:
+        """
+        Build the writes of a probe of parked apps: apps with a store page
+        again leave the negative cache and are due for details right away
+        """
+        now = datetime.now()
+        operations = []
+        for str_appid, result in app_results.items():
+            appid = int(str_appid)
+            if result and result.get('success'):
+                operations.append(('no_details', DeleteOne({'appid': appid})))
+                operations.append(('frontier', UpdateOne(
+                    {'appid': appid},
+                    {
+                        '$addToSet': {'pending': 'details'},
+                        '$set': {'priority': FRONTIER_NEW_APP_PRIORITY, 'next_due_at': now},
+                        '$unset': {'schedule.details': ''},
+                    },
+                    upsert=True
+                )))
             else:
-                logger.info(f"[UNCHANGED] No Details for AppID {appid}")
+                operations.append(('no_details', UpdateOne({'appid': appid}, {'$set': {'last_probed_at': now}})))
+        return operations
 
-    def upsert_app_tags(self, appid: int, app_tags: dict):
-        """Upsert of app tags into 'tags' collection"""
-        collection = self.database['tags']
-        result = collection.update_one(
+    # -----------------------
+    # Review Items
+    # -----------------------
+    def ensure_review_item_indexes(self):
+        collection = self.database['review_items']
+        collection.create_index('recommendationid', unique=True)
+        # Newest stored review per app, where paginated fetches stop
+        collection.create_index([('appid', 1), ('timestamp_created', -1)])
+
+    def load_latest_review_timestamps(self, appids: list) -> dict:
+        """Creation timestamp of the newest stored review per appid"""
+        cursor = self.database['review_items'].aggregate([
+            {'$match': {'appid': {'$in': appids}}},
+            {'$group': {'_id': '$appid', 'latest': {'$max': '$timestamp_created'}}},
+        ])
+        return {doc['_id']: doc['latest'] for doc in cursor}
+
+    def review_items_operations(self, appid: int, reviews: list) -> list[tuple[str, UpdateOne]]:
+        """Build the writes of individual JSON reviews into 'review_items'"""
+        return [
+            ('review_items', UpdateOne(
+                {'recommendationid': review['recommendationid']},
+                {'$set': {**review, 'appid': appid}},
+                upsert=True
+            ))
+            for review in reviews
+        ]
+
+    def review_summary_operation(self, appid: int, query_summary: dict) -> tuple[str, UpdateOne]:
+        """Build the write of the JSON review summary of an app into 'reviews'"""
+        return 'reviews', UpdateOne(
             {'appid': appid},
-            {'$set': app_tags},
+            {'$set': {'query_summary': query_summary, 'query_summary_updated_at': datetime.now()}},
             upsert=True
         )
-        if result.upserted_id:
-            logger.info(f"[INSERTED] Tags for AppID {appid}")
-        elif result.modified_count > 0:
-            logger.info(f"[UPDATED] Tags for AppID {appid}")
-        else:
-            logger.info(f"[UNCHANGED] Tags for AppID {appid}")
 
-    def upsert_app_reviews(self, appid: int, app_reviews: dict):
-        """Upsert of app reviews into 'reviews' collection"""
-        collection = self.database['reviews']
-        result = collection.update_one(
-            {'appid': appid},
-            {'$set': app_reviews},
-            upsert=True
+    # -----------------------
+    # Crawl Leases
+    # -----------------------
+    def create_crawl_shards(self, run_id: str, endpoint: str, appids: list, shard_size: int = 100) -> int:
+        """Split `appids` into shards of a run that workers claim through leases"""
+        collection = self.database['crawl_leases']
+        collection.create_index([('run_id', 1), ('endpoint', 1), ('shard', 1)], unique=True)
+        collection.create_index([('run_id', 1), ('endpoint', 1), ('status', 1), ('lease_expires_at', 1)])
+        operations = [
+            UpdateOne(
+                {'run_id': run_id, 'endpoint': endpoint, 'shard': shard},
+                # Shards of a retried task keep their progress
+                {'$setOnInsert': {'appids': list(batch), 'status': 'pending', 'attempts': 0, 'created_at': datetime.now()}},
+                upsert=True
+            )
+            for shard, batch in enumerate(chunked(appids, shard_size))
+        ]
+        if operations:
+            collection.bulk_write(operations, ordered=False)
+        logger.info(f"Created {len(operations)} {endpoint} shards of run {run_id}")
+        return len(operations)
+
+    def claim_crawl_shard(self, run_id: str, endpoint: str, owner: str, lease_duration: timedelta = CRAWL_LEASE_DURATION):
+        """
+        Atomically lease a pending shard, or one whose lease expired because
+        its worker died, and return it (None once every shard is taken).
+        """
+        now = datetime.now()
+        return self.database['crawl_leases'].find_one_and_update(
+            {
+                'run_id': run_id,
+                'endpoint': endpoint,
+                '$or': [
+                    {'status': 'pending'},
+                    {'status': 'leased', 'lease_expires_at': {'$lt': now}},
+                ],
+                'attempts': {'$lt': CRAWL_LEASE_MAX_ATTEMPTS},
+            },
+            {
+                '$set': {'status': 'leased', 'owner': owner, 'lease_expires_at': now + lease_duration},
+                '$inc': {'attempts': 1},
+            },
+            sort=[('shard', 1)],
+            return_document=ReturnDocument.AFTER,
         )
-        if result.upserted_id:
-            logger.info(f"[INSERTED] Reviews for AppID {appid}")
-        elif result.modified_count > 0:
-            logger.info(f"[UPDATED] Reviews for AppID {appid}")
+
+    def fail_exhausted_crawl_shards(self, run_id: str, endpoint: str) -> list:
+        """Mark the shards claimed the maximum number of times and not running anymore as failed"""
+        collection = self.database['crawl_leases']
+        query = {
+            'run_id': run_id,
+            'endpoint': endpoint,
+            '$or': [
+                {'status': 'pending'},
+                {'status': 'leased', 'lease_expires_at': {'$lt': datetime.now()}},
+            ],
+            'attempts': {'$gte': CRAWL_LEASE_MAX_ATTEMPTS},
+        }
+        shards = [doc['shard'] for doc in collection.find(query, {'_id': 0, 'shard': 1})]
+        if shards:
+            collection.update_many(
+                {**query, 'shard': {'$in': shards}},
+                {'$set': {'status': 'failed', 'failed_at': datetime.now()}, '$unset': {'owner': '', 'lease_expires_at': ''}}
+            )
+            logger.error(f"Gave up {endpoint} shards {shards} of run {run_id} after {CRAWL_LEASE_MAX_ATTEMPTS} attempts")
+        return shards
+
+    def failed_crawl_shards(self, run_id: str, endpoint: str) -> list:
+        """Shards of a run given up as failed"""
+        cursor = self.database['crawl_leases'].find(
+            {'run_id': run_id, 'endpoint': endpoint, 'status': 'failed'},
+            {'_id': 0, 'shard': 1}
+        )
+        return sorted(doc['shard'] for doc in cursor)
+
+    def next_crawl_lease_expiry(self, run_id: str, endpoint: str):
+        """Earliest expiry of the live leases of a run, None when no shard is leased"""
+        lease = self.database['crawl_leases'].find_one(
+            {'run_id': run_id, 'endpoint': endpoint, 'status': 'leased'},
+            {'_id': 0, 'lease_expires_at': 1},
+            sort=[('lease_expires_at', 1)],
+        )
+        return lease['lease_expires_at'] if lease else None
+
+    def renew_crawl_lease(self, shard_id, owner: str, lease_duration: timedelta = CRAWL_LEASE_DURATION) -> bool:
+        """Extend a lease, False when it was lost to another worker"""
+        result = self.database['crawl_leases'].update_one(
+            {'_id': shard_id, 'owner': owner, 'status': 'leased'},
+            {'$set': {'lease_expires_at': datetime.now() + lease_duration}}
+        )
+        return result.matched_count == 1
+
+    def release_crawl_shard(self, shard_id, owner: str, stats: dict = None):
+        """Mark a shard done with its crawl stats, or hand it back when `stats` is None"""
+        if stats is None:
+            update = {'$set': {'status': 'pending'}, '$unset': {'owner': '', 'lease_expires_at': ''}}
         else:
-            logger.info(f"[UNCHANGED] Reviews for AppID {appid}")
\ No newline at end of file
+            update = {'$set': {'status': 'done', 'stats': stats, 'done_at': datetime.now()}}
+        self.database['crawl_leases'].update_one({'_id': shard_id, 'owner': owner}, update)
+
+    def shared_rate_limiters(self, host_rate_limits: dict) -> dict:
+        """Per-host rate limiters whose budget is shared by every crawl process"""
+        return {
+            host: MongoRateLimiter(self.database['rate_budgets'], host, rate, capacity)
+            for host, (rate, capacity) in host_rate_limits.items()
+        }
+
+class MongoRateLimiter:
+    """
+    Token bucket of a host shared across processes through one Mongo document.
+
+    Uses the generic cell rate algorithm: the document holds the theoretical
+    arrival time (in ms of the server clock) of the next request, and every
+    reservation atomically pushes it one interval further. Up to `capacity`
+    requests may go out back to back.
+    """
+
+    def __init__(self, collection, host: str, rate: float, capacity: int = 1):
+        self.collection = collection
+        self.host = host
+        self.rate = rate
+        self.capacity = capacity
+        self.interval_ms = 1000 / rate
+        self.tolerance_ms = (capacity - 1) * self.interval_ms
+
+    def reserve(self) -> float:
+        """Take a slot and return the seconds to wait before it can be used."""
+        budget = self.collection.find_one_and_update(
+            {'_id': self.host},
+            [
+                {'$set': {'now': {'$toLong': '$$NOW'}}},
+                {'$set': {'tat': {'$add': [{'$max': [{'$ifNull': ['$tat', 0]}, '$now']}, self.interval_ms]}}},
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        start_ms = budget['tat'] - self.interval_ms
+        return max(0.0, (start_ms - budget['now'] - self.tolerance_ms) / 1000)
+
+    def wait(self) -> None:
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire(self) -> None:
+        delay = await asyncio.to_thread(self.reserve)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+class MongoBulkWriter:
+    """
+    Buffer write operations per collection and flush them as unordered
+    `bulk_write` batches once `batch_size` operations are pending or
+    `flush_interval` seconds passed since the last flush. The latency of every
+    bulk write is recorded in `metrics` (a `CrawlMetrics`) when given.
+    Safe to share between threads.
+    """
+
+    def __init__(self, database, batch_size: int = 500, flush_interval: float = 5.0, metrics=None):
+        self.database = database
+        self.metrics = metrics
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.buffers = defaultdict(list)
+        self.pending = 0
+        self.operations = 0
+        self.last_flush_at = time.monotonic()
+        self.counters = defaultdict(lambda: {'inserted': 0, 'updated': 0, 'unchanged': 0, 'deleted': 0})
+        self._lock = threading.RLock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def add(self, collection_name: str, operation):
+        with self._lock:
+            self.buffers[collection_name].append(operation)
+            self.pending += 1
+            self.operations += 1
+            if self.pending >= self.batch_size or time.monotonic() - self.last_flush_at >= self.flush_interval:
+                self.flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        for collection_name, operations in self.buffers.items():
+            if not operations:
+                continue
+            started_at = time.perf_counter()
+            result = self.database[collection_name].bulk_write(operations, ordered=False)
+            if self.metrics is not None:
+                self.metrics.observe_write(collection_name, time.perf_counter() - started_at, len(operations))
+            counters = self.counters[collection_name]
+            counters['inserted'] += result.upserted_count
+            counters['updated'] += result.modified_count
+            counters['unchanged'] += result.matched_count - result.modified_count
+            counters['deleted'] += result.deleted_count
+            logger.info(
+                f"Bulk wrote {collection_name} - Total: {len(operations)}, "
+                f"Inserted: {result.upserted_count}, "
+                f"Updated: {result.modified_count}, "
+                f"Unchanged: {result.matched_count - result.modified_count}, "
+                f"Deleted: {result.deleted_count}"
+            )
+            operations.clear()
+        self.pending = 0
+        self.last_flush_at = time.monotonic()
+
+    def close(self):
+        self.flush()
+        for collection_name, counters in self.counters.items():
+            logger.info(
+                f"Finished writing {collection_name} - "
+                f"Inserted: {counters['inserted']}, "
+                f"Updated: {counters['updated']}, "
+                f"Unchanged: {counters['unchanged']}, "
+                f"Deleted: {counters['deleted']}"
+            )
+
+    def summary(self) -> dict:
+        return {collection_name: dict(counters) for collection_name, counters in self.counters.items()}
@@ -1,12 +1,38 @@
+import io
 import os
+import time
+import logging
+from typing import Optional
 import psycopg2
 import polars as pl
 
+logger = logging.getLogger("PostgresManager")
+
+# Columns loaded into each staging table, `appid` is the conflict key
+APP_DETAILS_COLUMNS = [
+    'appid', 'name', 'game_appid',
+    'enrich_is_description', 'long_description', 'short_description',
+    'image_header', 'image_background', 'image_screenshots', 'image_movies',
+    'enrich_is_price', 'is_free', 'currency', 'price',
+    'type', 'categories', 'genres', 'supported_languages', 'is_controller_support',
+    'enrich_is_date', 'release_date',
+    'required_age',
+    'developers', 'publishers', 'content_descriptors_notes',
+    'achievements',
+    'enrich_is_windows', 'is_windows', 'windows_requirements_minimum', 'windows_requirements_recommended',
+    'enrich_is_mac', 'is_mac', 'mac_requirements_minimum', 'mac_requirements_recommended',
+    'enrich_is_linux', 'is_linux', 'linux_requirements_minimum', 'linux_requirements_recommended',
+]
+APP_TAGS_COLUMNS = ['appid', 'tags']
+APP_REVIEWS_COLUMNS = ['appid', 'html', 'review_score']
+
+UPSERT_METHODS = ('copy', 'row')
+
 
 class PostgresManager:
     """Handle PostgreSQL database operations"""
     
-    def __init__(self):
+    def __init__(self, upsert_method: Optional[str] = None):
         # Connect to the database
         self.db_params = {
             'host': os.getenv('PGDB_HOST'),
@@ -15,8 +41,63 @@ class PostgresManager:
             'database': os.getenv('PGDB_NAME'),
             'port': os.getenv('PGDB_PORT')
         }
+        # 'copy' bulk loads each batch, 'row' runs one upsert statement per row
+        self.upsert_method = upsert_method or os.getenv('PGDB_UPSERT_METHOD', 'copy')
+        if self.upsert_method not in UPSERT_METHODS:
+            raise ValueError(f"Unknown upsert method '{self.upsert_method}', expected one of {UPSERT_METHODS}")
+
+    def copy_upsert(self, table: str, df: pl.DataFrame, columns: list, key: str = 'appid') -> int:
+        """
+        Upsert a batch in two set-based statements: COPY it into a temporary
+        table, then merge that table with one INSERT ... ON CONFLICT DO UPDATE.
+        """
+        # One row per key as ON CONFLICT can't update a row twice, the last one wins like row by row
+        df = df.select(columns).unique(subset=key, keep='last', maintain_order=True)
+        if df.is_empty():
+            return 0
+
+        # Strings are always quoted so only unquoted \N reads as NULL
+        buffer = io.BytesIO()
+        df.write_csv(buffer, include_header=False, null_value='\\N', quote_style='non_numeric')
+        buffer.seek(0)
+
+        temp_table = f"tmp_{table.split('.')[-1]}"
+        column_list = ', '.join(columns)
+        updated_at = "(NOW() AT TIME ZONE 'UTC' AT TIME ZONE 'Asia/Seoul')"
+        merge_query = f"""
+            INSERT INTO {table} ({column_list}, updated_at)
+            SELECT {column_list}, {updated_at} FROM {temp_table}
+            ON CONFLICT ({key})
+            DO UPDATE SET
+                {', '.join(f"{column} = EXCLUDED.{column}" for column in columns if column != key)},
+                updated_at = {updated_at}
+        """
+
+        conn = psycopg2.connect(**self.db_params)
+        cur = conn.cursor()
+        start = time.perf_counter()
+        try:
+            cur.execute(f"CREATE TEMP TABLE {temp_table} (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP")
+            cur.copy_expert(f"COPY {temp_table} ({column_list}) FROM STDIN WITH (FORMAT csv, NULL '\\N')", buffer)
+            cur.execute(merge_query)
+            conn.commit()
+
+        except Exception as e:
+            conn.rollback()
+            raise Exception(f"Error bulk upserting into {table}: {str(e)}")
+
+        finally:
+            cur.close()
+            conn.close()
+
+        elapsed = time.perf_counter() - start
+        logger.info(f"Upserted {len(df)} rows into {table} in {elapsed:.2f}s ({len(df) / elapsed:.0f} rows/sec)")
+        return len(df)
+
+    def upsert_app_details(self, df_app_details: pl.DataFrame, method: Optional[str] = None):
+        if (method or self.upsert_method) == 'copy':
+            return self.copy_upsert('staging.app_details', df_app_details, APP_DETAILS_COLUMNS)
 
-    def upsert_app_details(self, df_app_details: pl.DataFrame):
         conn = psycopg2.connect(**self.db_params)
         cur = conn.cursor()
         
@@ -96,11 +177,14 @@ class PostgresManager:
             """
             
             # Iterate over each row of Polars DataFrame
+            start = time.perf_counter()
             for row in df_app_details.iter_rows(named=True):
                 # Note: Convert Polars-specific types to Python native if needed here
                 cur.execute(upsert_query, row)
             
             conn.commit()
+            elapsed = time.perf_counter() - start
+            logger.info(f"Upserted {len(df_app_details)} rows into staging.app_details row by row in {elapsed:.2f}s ({len(df_app_details) / elapsed:.0f} rows/sec)")
         
         except Exception as e:
             conn.rollback()
@@ -110,7 +194,10 @@ class PostgresManager:
             cur.close()
             conn.close()
             
-    def upsert_app_tags(self, df_app_tags: pl.DataFrame):
+    def upsert_app_tags(self, df_app_tags: pl.DataFrame, method: Optional[str] = None):
+        if (method or self.upsert_method) == 'copy':
+            return self.copy_upsert('staging.app_tags', df_app_tags, APP_TAGS_COLUMNS)
+
         conn = psycopg2.connect(**self.db_params)
         cur = conn.cursor()
         
@@ -130,11 +217,14 @@ class PostgresManager:
             """
             
             # Iterate over each row of Polars DataFrame
+            start = time.perf_counter()
             for row in df_app_tags.iter_rows(named=True):
                 # Note: Convert Polars-specific types to Python native if needed here
                 cur.execute(upsert_query, row)
             
             conn.commit()
+            elapsed = time.perf_counter() - start
+            logger.info(f"Upserted {len(df_app_tags)} rows into staging.app_tags row by row in {elapsed:.2f}s ({len(df_app_tags) / elapsed:.0f} rows/sec)")
         
         except Exception as e:
             conn.rollback()
@@ -144,7 +234,10 @@ class PostgresManager:
             cur.close()
             conn.close()
     
-    def upsert_app_reviews(self, df_app_reviews: pl.DataFrame):
+    def upsert_app_reviews(self, df_app_reviews: pl.DataFrame, method: Optional[str] = None):
+        if (method or self.upsert_method) == 'copy':
+            return self.copy_upsert('staging.app_reviews', df_app_reviews, APP_REVIEWS_COLUMNS)
+
         conn = psycopg2.connect(**self.db_params)
         cur = conn.cursor()
         
@@ -165,11 +258,14 @@ class PostgresManager:
             """
             
             # Iterate over each row of Polars DataFrame
+            start = time.perf_counter()
             for row in df_app_reviews.iter_rows(named=True):
                 # Note: Convert Polars-specific types to Python native if needed here
                 cur.execute(upsert_query, row)
             
             conn.commit()
+            elapsed = time.perf_counter() - start
+            logger.info(f"Upserted {len(df_app_reviews)} rows into staging.app_reviews row by row in {elapsed:.2f}s ({len(df_app_reviews) / elapsed:.0f} rows/sec)")
         
         except Exception as e:
             conn.rollback()
@@ -1,19 +1,88 @@
 import os
-from typing import Optional
+from typing import Any, Awaitable, Callable, Iterator, Optional
+from types import SimpleNamespace
+from collections import defaultdict
+from urllib.parse import urlparse
 import random
 import logging
+import asyncio
+import aiohttp
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import make_headers
+import json
 import time
 from json.decoder import JSONDecodeError
+from data_pipeline.utils.utils_metrics import CrawlMetrics
+from data_pipeline.utils.utils_crawl import (
+    TokenBucket,
+    AIMDRateController,
+    CircuitBreaker,
+    CircuitOpenError,
+    ResponseCache,
+    Stage,
+    StagedPipeline,
+    parse_retry_after,
+    iter_json_array,
+)
 
 
 logger = logging.getLogger("SteamAPIManager")
 
+# Request budget per host as (requests per second, burst size).
+# These are hard ceilings, the AIMD controllers find the usable rate below them.
+HOST_RATE_LIMITS = {
+    "store.steampowered.com": (2.0, 3),
+    "api.steampowered.com": (5.0, 5),
+    "steamspy.com": (1.0, 1),
+}
+
+# Starting rate per endpoint (requests per second) before any rate was learned
+ENDPOINT_INITIAL_RATES = {
+    "names": 1.0,
+    "details": 0.4,
+    "prices": 0.4,
+    "reviews": 0.4,
+    "tags": 1.0,
+}
+
+ENDPOINT_HOSTS = {
+    "names": "api.steampowered.com",
+    "details": "store.steampowered.com",
+    "prices": "store.steampowered.com",
+    "reviews": "store.steampowered.com",
+    "tags": "steamspy.com",
+}
+
 class SteamAPIManager:
     """Handle Steam API interactions"""
     
-    def __init__(self, api_key: Optional[str] = None):
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        max_in_flight: int = 8,
+        cache_dir: Optional[str] = None,
+        cache_mode: Optional[str] = None,
+        cache_ttl: Optional[float] = None,
+    ):
         self.api_key = api_key or os.getenv('STEAM_API_KEY')
+        self.max_in_flight = max_in_flight
+        # Compressed response cache, 'replay' serves runs entirely from disk
+        self.cache = ResponseCache(
+            cache_dir or os.getenv('STEAM_CACHE_DIR'),
+            mode=cache_mode or os.getenv('STEAM_CACHE_MODE', 'off'),
+            ttl=cache_ttl or float(os.getenv('STEAM_CACHE_TTL', 86400)),
+        )
+        self.rate_limiters = {
+            host: TokenBucket(rate, capacity)
+            for host, (rate, capacity) in HOST_RATE_LIMITS.items()
+        }
+        self.rate_controllers = {
+            endpoint: AIMDRateController(
+                endpoint, rate, max_rate=HOST_RATE_LIMITS[ENDPOINT_HOSTS[endpoint]][0]
+            )
+            for endpoint, rate in ENDPOINT_INITIAL_RATES.items()
+        }
         self.user_agents = [
             "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
             "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Edge/91.0.864.64",
@@ -23,62 +92,513 @@ class SteamAPIManager:
             "Mozilla/5.0 (iPhone; CPU iPhone OS 14_0 like Mac OS X) AppleWebKit/537.36 (KHTML, like Gecko) Mobile/15E148 Safari/604.1",
             "Mozilla/5.0 (Android 10; Mobile; rv:85.0) Gecko/85.0 Firefox/85.0"
         ]
+        # Fail fast on hosts that keep erroring instead of retrying every appid
+        self.circuit_breakers = {host: CircuitBreaker(host) for host in HOST_RATE_LIMITS}
+        # Latency, status, retry and backoff telemetry per endpoint
+        self.metrics = CrawlMetrics()
+        # Keep-alive connection pools per host, sized to the crawl concurrency
+        self.sessions: dict[str, requests.Session] = {}
+        self.async_sessions: dict[str, aiohttp.ClientSession] = {}
+        self.async_pool_stats = defaultdict(lambda: {'requests': 0, 'connections': 0, 'connect_seconds': 0.0})
+
+    # -----------------------
+    # Connection Pools
+    # -----------------------
+    def _get_session(self, url: str) -> requests.Session:
+        host = urlparse(url).hostname
+        if host not in self.sessions:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_in_flight)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            # gzip/deflate, plus br/zstd when their decoders are installed
+            session.headers.update(make_headers(accept_encoding=True))
+            self.sessions[host] = session
+        return self.sessions[host]
+
+    def _get_async_session(self, url: str) -> aiohttp.ClientSession:
+        host = urlparse(url).hostname
+        if host not in self.async_sessions:
+            stats = self.async_pool_stats[host]
+
+            async def on_request_start(session, ctx, params):
+                stats['requests'] += 1
+
+            async def on_connection_create_start(session, ctx, params):
+                ctx.connect_started_at = time.perf_counter()
+
+            async def on_connection_create_end(session, ctx, params):
+                stats['connections'] += 1
+                stats['connect_seconds'] += time.perf_counter() - ctx.connect_started_at
+
+            trace_config = aiohttp.TraceConfig(trace_config_ctx_factory=SimpleNamespace)
+            trace_config.on_request_start.append(on_request_start)
+            trace_config.on_connection_create_start.append(on_connection_create_start)
+            trace_config.on_connection_create_end.append(on_connection_create_end)
+
+            # aiohttp advertises gzip/deflate (and br when Brotli is installed) by default
+            self.async_sessions[host] = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit_per_host=self.max_in_flight, keepalive_timeout=60, ttl_dns_cache=300),
+                trace_configs=[trace_config],
+            )
+        return self.async_sessions[host]
+
+    async def _close_async_sessions(self) -> None:
+        # aiohttp sessions are bound to the event loop of the crawl that opened them
+        for session in self.async_sessions.values():
+            await session.close()
+        self.async_sessions.clear()
+
+    def close(self) -> None:
+        for session in self.sessions.values():
+            session.close()
+        self.sessions.clear()
+
+    def get_pool_stats(self) -> dict:
+        """Requests, new connections, reuse ratio and connect time per host."""
+        pool_stats = {}
+        for host, stats in self.async_pool_stats.items():
+            pool_stats[host] = {
+                'requests': stats['requests'],
+                'connections': stats['connections'],
+                'avg_connect_ms': round(1000 * stats['connect_seconds'] / stats['connections'], 2) if stats['connections'] else None,
+            }
+        for host, session in self.sessions.items():
+            # urllib3 keeps its own counters on every connection pool
+            requests_count = connections = 0
+            for adapter in {id(adapter): adapter for adapter in session.adapters.values()}.values():
+                for key in adapter.poolmanager.pools.keys():
+                    pool = adapter.poolmanager.pools[key]
+                    requests_count += pool.num_requests
+                    connections += pool.num_connections
+            stats = pool_stats.setdefault(host, {'requests': 0, 'connections': 0, 'avg_connect_ms': None})
+            stats['requests'] += requests_count
+            stats['connections'] += connections
+        for stats in pool_stats.values():
+            stats['reuse_ratio'] = round(1 - stats['connections'] / stats['requests'], 4) if stats['requests'] else None
+        return pool_stats
+
+    def _get_rate_limiter(self, url: str) -> Optional[TokenBucket]:
+        return self.rate_limiters.get(urlparse(url).hostname)
+
+    def _get_circuit_breaker(self, url: str) -> Optional[CircuitBreaker]:
+        return self.circuit_breakers.get(urlparse(url).hostname)
+
+    def circuit_retry_in(self, endpoint: str) -> float:
+        """Seconds until the circuit of the host of `endpoint` lets requests through again."""
+        breaker = self.circuit_breakers.get(ENDPOINT_HOSTS.get(endpoint))
+        return breaker.retry_in() if breaker else 0.0
+
+    def get_rates(self) -> dict:
+        """Current learned rate of every endpoint in requests per second."""
+        return {endpoint: controller.rate for endpoint, controller in self.rate_controllers.items()}
+
+    def set_rates(self, rates: dict) -> None:
+        """Restore rates learned by previous runs (see `get_rates`)."""
+        for endpoint, rate in rates.items():
+            controller = self.rate_controllers.get(endpoint)
+            if controller and rate:
+                controller.rate = min(max(rate, controller.min_rate), controller.max_rate)
+
+    def _parse_response(self, text: str, return_type: str, url: str):
+        try:
+            return json.loads(text) if return_type == 'json' else text
+        except JSONDecodeError as e:
+            logger.warning(f"JSONDecodeError for URL {url}: {e}")
+            return None
+
+    def _make_request(self, url: str, params: dict = None, return_type: str = 'json', endpoint: Optional[str] = None, stream: bool = False):
+        """
+        GET `url` with retries, throttling and circuit breaking. With `stream`,
+        the open response is returned for the caller to read (and close) instead.
+        """
+        cached = None if stream else self.cache.get(endpoint or 'other', url, params)
+        if cached is not None:
+            return self._parse_response(cached.decode('utf-8'), return_type, url)
 
-    def _make_request(self, url: str, params: dict = None, return_type: str = 'json'):
         max_retries = 5
         headers = {
             "User-Agent": random.choice(self.user_agents),
             "Accept": "application/json"
         }
+        rate_limiter = self._get_rate_limiter(url)
+        rate_controller = self.rate_controllers.get(endpoint)
+        metric_endpoint = endpoint or 'other'
+        circuit_breaker = self._get_circuit_breaker(url)
 
         for attempt in range(1, max_retries + 1):
             try:
-                response = requests.get(url, params=params, headers=headers, timeout=10)
+                # Raises CircuitOpenError, which is not retried
+                if circuit_breaker:
+                    circuit_breaker.check()
+                wait_started_at = time.perf_counter()
+                if rate_controller:
+                    rate_controller.wait()
+                if rate_limiter:
+                    rate_limiter.wait()
+                request_started_at = time.perf_counter()
+                self.metrics.record_rate_wait(metric_endpoint, request_started_at - wait_started_at)
+                response = self._get_session(url).get(url, params=params, headers=headers, timeout=30 if stream else 10, stream=stream)
+                # A streamed body isn't read yet, its size is only known from the headers
+                size = int(response.headers.get('Content-Length') or 0) if stream else len(response.content)
+                self.metrics.observe_request(metric_endpoint, response.status_code, time.perf_counter() - request_started_at, size)
+                if circuit_breaker:
+                    circuit_breaker.record_failure() if response.status_code >= 500 else circuit_breaker.record_success()
 
                 if response.status_code == 200:
+                    if rate_controller:
+                        rate_controller.on_success()
+                    if stream:
+                        return response
+                    self.cache.put(endpoint or 'other', url, params, response.content)
                     try:
-                        time.sleep(3)
                         return response.json() if return_type == 'json' else response.text
                     except JSONDecodeError as e:
                         logger.warning(f"JSONDecodeError for URL {url}: {e}")
                         return None
 
                 if response.status_code in {429} or 500 <= response.status_code < 600:
-                    time.sleep(30)
+                    retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                    throttle_pause = retry_after if retry_after is not None else 2 ** attempt
+                    if rate_controller:
+                        rate_controller.on_throttle(throttle_pause)
+                    elif retry_after:
+                        time.sleep(retry_after)
+                    response.close()
                     raise requests.HTTPError(f"Retryable HTTP error: {response.status_code}", response=response)
 
                 else:
                     logger.error(f"Non-retryable error: {response.status_code} - {response.text}")
                     raise Exception(f"Non-retryable error: {response.status_code} - {response.text}")
 
+            except requests.HTTPError as e:
+                # Throttled responses are paced by the rate controller on the next attempt
+                if attempt == max_retries:
+                    logger.critical(f"All {max_retries} retries failed for URL: {url}")
+                    raise
+                self.metrics.record_retry(metric_endpoint, throttle_pause if rate_controller or retry_after else 0.0)
+                logger.warning(f"[Attempt {attempt}/{max_retries}] Error: {e}. Retrying")
+
             except (requests.RequestException, requests.Timeout) as e:
+                self.metrics.observe_request(metric_endpoint, 'error', time.perf_counter() - request_started_at)
+                if circuit_breaker:
+                    circuit_breaker.record_failure()
                 if attempt == max_retries:
                     logger.critical(f"All {max_retries} retries failed for URL: {url}")
                     raise
 
                 backoff = 2 ** attempt + random.uniform(0, 0.5)
+                self.metrics.record_retry(metric_endpoint, backoff)
                 logger.warning(f"[Attempt {attempt}/{max_retries}] Error: {e}. Retrying in {backoff:.2f}s")
                 time.sleep(backoff)
 
+    async def _make_request_async(self, url: str, params: dict = None, return_type: str = 'json', endpoint: Optional[str] = None):
+        """Async counterpart of `_make_request` sharing the per-host rate budgets."""
+        if self.cache.enabled:
+            cached = await asyncio.to_thread(self.cache.get, endpoint or 'other', url, params)
+            if cached is not None:
+                return self._parse_response(cached.decode('utf-8'), return_type, url)
+
+        max_retries = 5
+        headers = {
+            "User-Agent": random.choice(self.user_agents),
+            "Accept": "application/json"
+        }
+        rate_limiter = self._get_rate_limiter(url)
+        rate_controller = self.rate_controllers.get(endpoint)
+        metric_endpoint = endpoint or 'other'
+        circuit_breaker = self._get_circuit_breaker(url)
+
+        for attempt in range(1, max_retries + 1):
+            try:
+                # Raises CircuitOpenError, which is not retried
+                if circuit_breaker:
+                    circuit_breaker.check()
+                wait_started_at = time.perf_counter()
+                if rate_controller:
+                    await rate_controller.acquire()
+                if rate_limiter:
+                    await rate_limiter.acquire()
+                request_started_at = time.perf_counter()
+                self.metrics.record_rate_wait(metric_endpoint, request_started_at - wait_started_at)
+                async with self._get_async_session(url).get(url, params=params, headers=headers, timeout=aiohttp.ClientTimeout(total=10)) as response:
+                    body = await response.read()
+                    text = await response.text()
+                self.metrics.observe_request(metric_endpoint, response.status, time.perf_counter() - request_started_at, len(body))
+                if circuit_breaker:
+                    circuit_breaker.record_failure() if response.status >= 500 else circuit_breaker.record_success()
+
+                if response.status == 200:
+                    if rate_controller:
+                        rate_controller.on_success()
+                    if self.cache.enabled:
+                        await asyncio.to_thread(self.cache.put, endpoint or 'other', url, params, text.encode('utf-8'))
+                    return self._parse_response(text, return_type, url)
+
+                if response.status in {429} or 500 <= response.status < 600:
+                    retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                    throttle_pause = retry_after if retry_after is not None else 2 ** attempt
+                    if rate_controller:
+                        rate_controller.on_throttle(throttle_pause)
+                    elif retry_after:
+                        await asyncio.sleep(retry_after)
+                    raise aiohttp.ClientResponseError(
+                        response.request_info, response.history,
+                        status=response.status, message=f"Retryable HTTP error: {response.status}"
+                    )
+
+                else:
+                    logger.error(f"Non-retryable error: {response.status} - {text}")
+                    raise Exception(f"Non-retryable error: {response.status} - {text}")
+
+            except aiohttp.ClientResponseError as e:
+                # Throttled responses are paced by the rate controller on the next attempt
+                if attempt == max_retries:
+                    logger.critical(f"All {max_retries} retries failed for URL: {url}")
+                    raise
+                self.metrics.record_retry(metric_endpoint, throttle_pause if rate_controller or retry_after else 0.0)
+                logger.warning(f"[Attempt {attempt}/{max_retries}] Error: {e.message}. Retrying")
+
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.metrics.observe_request(metric_endpoint, 'error', time.perf_counter() - request_started_at)
+                if circuit_breaker:
+                    circuit_breaker.record_failure()
+                if attempt == max_retries:
+                    logger.critical(f"All {max_retries} retries failed for URL: {url}")
+                    raise
+
+                backoff = 2 ** attempt + random.uniform(0, 0.5)
+                self.metrics.record_retry(metric_endpoint, backoff)
+                logger.warning(f"[Attempt {attempt}/{max_retries}] Error: {e!r}. Retrying in {backoff:.2f}s")
+                await asyncio.sleep(backoff)
+
+    # -----------------------
+    # Crawl Engine
+    # -----------------------
+    def _endpoint_request(self, endpoint: str, app_id) -> tuple[str, Optional[dict]]:
+        """Return the URL and query parameters of a per-app endpoint."""
+        if endpoint == 'details':
+            return "https://store.steampowered.com/api/appdetails", {"appids": app_id}
+        if endpoint == 'prices':
+            # appdetails only accepts several appids at once when filtered to price_overview
+            app_ids = ",".join(str(appid) for appid in app_id)
+            return "https://store.steampowered.com/api/appdetails", {"appids": app_ids, "filters": "price_overview"}
+        if endpoint == 'reviews':
+            return f"https://store.steampowered.com/appreviews/{app_id}", None
+        if endpoint == 'review_pages':
+            # JSON reviews newest first, `app_id` is (appid, cursor)
+            app_id, cursor = app_id
+            return f"https://store.steampowered.com/appreviews/{app_id}", {
+                "json": 1, "cursor": cursor, "num_per_page": 100,
+                "filter": "recent", "language": "all", "purchase_type": "all",
+            }
+        if endpoint == 'tags':
+            return "https://steamspy.com/api.php", {"request": "appdetails", "appid": app_id}
+        raise ValueError(f"Unknown endpoint: {endpoint}")
+
+    async def crawl(
+        self,
+        endpoint: str,
+        appids: list,
+        handler: Callable[[int, Optional[dict]], Any],
+        fetch: Optional[Callable[[int], Awaitable[Optional[dict]]]] = None,
+        write: Optional[Callable[[Any], None]] = None,
+        transform_workers: int = 2,
+        queue_size: int = 64,
+    ) -> dict:
+        """
+        Fetch `endpoint` for every appid with at most `max_in_flight` requests
+        in flight and hand each response to `handler(appid, payload)`.
+        `fetch(appid)` replaces the single request per appid when given.
+
+        With `write`, the crawl runs as a fetch -> transform -> write pipeline:
+        `handler` runs in `transform_workers` threads and every result it
+        returns is passed to `write(result)` in a single writer thread, so
+        responses keep arriving while earlier ones are written. Bounded queues
+        between the stages hold back fetching when the writes fall behind.
+
+        Requests that still fail after their retries are logged and counted,
+        they do not stop the rest of the crawl. Appids of a host whose circuit
+        is open are not requested and returned in `stats['deferred']`.
+        """
+        stats = {'requested': len(appids), 'fetched': 0, 'failed': 0, 'deferred': []}
+
+        async def fetch_one(appid):
+            try:
+                if fetch:
+                    payload = await fetch(appid)
+                else:
+                    url, params = self._endpoint_request(endpoint, appid)
+                    payload = await self._make_request_async(url, params, endpoint=endpoint)
+            except CircuitOpenError:
+                # Left for a later crawl instead of waiting on a failing host
+                stats['deferred'].append(appid)
+                return None
+            except Exception as e:
+                stats['failed'] += 1
+                logger.error(f"Failed to fetch {endpoint} for AppID {appid}: {e!r}")
+                return None
+            stats['fetched'] += 1
+            return appid, payload
+
+        # At most `max_in_flight` appids are being requested at any time
+        stages = [Stage('fetch', fetch_one, concurrency=max(1, min(self.max_in_flight, len(appids))))]
+        if write:
+            stages += [
+                Stage('transform', lambda item: handler(*item), concurrency=transform_workers, blocking=True),
+                Stage('write', write, blocking=True),
+            ]
+        else:
+            stages.append(Stage('handle', lambda item: handler(*item)))
+
+        try:
+            stats['stages'] = await StagedPipeline(stages, queue_size=queue_size).run(appids)
+        finally:
+            await self._close_async_sessions()
+            if self.cache.enabled:
+                await asyncio.to_thread(self.cache.evict)
+
+        stats['rate'] = self.rate_controllers[endpoint].snapshot()
+        logger.info(
+            f"Crawled {endpoint} - Requested: {stats['requested']}, "
+            f"Fetched: {stats['fetched']}, Failed: {stats['failed']}, Deferred: {len(stats['deferred'])}, "
+            f"Rate: {stats['rate']['rate']} req/s"
+        )
+        logger.info(f"Connection pools: {self.get_pool_stats()}")
+        logger.info(f"Pipeline stages: {stats['stages']}")
+        if self.cache.enabled:
+            stats['cache'] = dict(self.cache.stats)
+        return stats
+
     # -----------------------
     # API Call Methods
     # -----------------------
     def get_app_names(self):
         url = "https://api.steampowered.com/ISteamApps/GetAppList/v0002"
-        return self._make_request(url)
+        return self._make_request(url, endpoint='names')
+
+    def iter_app_names(self, chunk_size: int = 10000) -> Iterator[list]:
+        """
+        Yield the full app list in chunks of at most `chunk_size` apps,
+        parsing the response while it streams instead of loading it whole.
+        """
+        url = "https://api.steampowered.com/ISteamApps/GetAppList/v0002"
+        cached_chunks = self.cache.iter_chunks('names', url)
+        if cached_chunks is not None:
+            yield from self._chunk_apps(cached_chunks, chunk_size)
+            return
+
+        # A stream cut off midway is restarted, skipping the apps already yielded
+        max_restarts = 3
+        yielded_appids = set()
+        for attempt in range(1, max_restarts + 1):
+            # Opening the stream goes through the usual retries, throttling and circuit breaking
+            response = self._make_request(url, endpoint='names', stream=True)
+            try:
+                with response, self.cache.writer('names', url) as cache_file:
+                    def body_chunks():
+                        for body_chunk in response.iter_content(chunk_size=64 * 1024):
+                            if cache_file is not None:
+                                cache_file.write(body_chunk)
+                            yield body_chunk
+                    chunks = body_chunks()
+                    for chunk in self._chunk_apps(chunks, chunk_size):
+                        chunk = [app for app in chunk if app.get('appid') not in yielded_appids]
+                        yielded_appids.update(app.get('appid') for app in chunk)
+                        if chunk:
+                            yield chunk
+                    # Read past the end of the array so the cached copy is complete
+                    for _ in chunks:
+                        pass
+                return
+
+            except (requests.RequestException, ValueError) as e:
+                # Connection drops surface as RequestException, a truncated body as ValueError
+                circuit_breaker = self._get_circuit_breaker(url)
+                if circuit_breaker:
+                    circuit_breaker.record_failure()
+                if attempt == max_restarts:
+                    logger.critical(f"App list stream failed {max_restarts} times for URL: {url}")
+                    raise
+                backoff = 2 ** attempt + random.uniform(0, 0.5)
+                self.metrics.record_retry('names', backoff)
+                logger.warning(f"[Attempt {attempt}/{max_restarts}] App list stream broke: {e}. Restarting in {backoff:.2f}s")
+                time.sleep(backoff)
+
+    def _chunk_apps(self, body_chunks: Iterator[bytes], chunk_size: int) -> Iterator[list]:
+        chunk = []
+        for app in iter_json_array(body_chunks, 'apps'):
+            chunk.append(app)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
 
     def get_app_details(self, app_id: int):
-        url = "https://store.steampowered.com/api/appdetails"
-        params = {"appids": app_id}
-        return self._make_request(url, params)
+        url, params = self._endpoint_request('details', app_id)
+        return self._make_request(url, params, endpoint='details')
+
+    def get_app_prices(self, app_ids: list):
+        url, params = self._endpoint_request('prices', app_ids)
+        return self._make_request(url, params, endpoint='prices')
 
     def get_app_reviews(self, app_id: int):
-        # TODO: This endpoint provides limited reviews, consider
-        # using the pagination for the full set of reviews.
-        url = f"https://store.steampowered.com/appreviews/{app_id}"
-        return self._make_request(url)
+        # The store page only holds a handful of reviews,
+        # see `fetch_review_pages` for the paginated JSON reviews.
+        url, params = self._endpoint_request('reviews', app_id)
+        return self._make_request(url, params, endpoint='reviews')
+
+    async def fetch_review_pages(
+        self,
+        app_id: int,
+        on_page: Callable[[int, list], Optional[Awaitable]],
+        max_reviews: int = 1000,
+        since: Optional[int] = None,
+    ) -> Optional[dict]:
+        """
+        Page through the JSON reviews of an app newest first, handing every
+        page to `on_page(app_id, reviews)` as it arrives (awaited if it returns
+        an awaitable, so it can move blocking writes off the event loop).
+
+        Stops after `max_reviews` reviews, at the first review created at or
+        before the `since` timestamp (i.e. already stored), or at the last page.
+        Returns the query summary of the app and the number of reviews fetched.
+        """
+        cursor, seen_cursors = '*', set()
+        summary, fetched = None, 0
+
+        while fetched < max_reviews:
+            url, params = self._endpoint_request('review_pages', (app_id, cursor))
+            page = await self._make_request_async(url, params, endpoint='reviews')
+            if not page or page.get('success') != 1:
+                break
+            if summary is None:
+                summary = page.get('query_summary')
+
+            reviews = page.get('reviews') or []
+            new_reviews = [
+                review for review in reviews
+                if since is None or review.get('timestamp_created', 0) > since
+            ][:max_reviews - fetched]
+            if new_reviews:
+                stored = on_page(app_id, new_reviews)
+                if stored is not None:
+                    await stored
+                fetched += len(new_reviews)
+            if len(new_reviews) < len(reviews) or not reviews:
+                break
+
+            # The last page hands back the cursor it was requested with
+            seen_cursors.add(cursor)
+            cursor = page.get('cursor')
+            if not cursor or cursor in seen_cursors:
+                break
+
+        if summary is None:
+            return None
+        return {'query_summary': summary, 'fetched_reviews': fetched}
 
     def get_app_tags(self, app_id: int):
-        url = "https://steamspy.com/api.php"
-        params = {"request": "appdetails", "appid": app_id}
-        return self._make_request(url, params)
\ No newline at end of file
+        url, params = self._endpoint_request('tags', app_id)
+        return self._make_request(url, params, endpoint='tags')
@@ -1,123 +1,349 @@
+import os
+import socket
+import asyncio
 import logging
-from collections import defaultdict
-from datetime import datetime
-from data_pipeline.managers.steam_api_manager import SteamAPIManager
-from data_pipeline.managers.mongo_manager import MongoManager
+import threading
+import time
+from datetime import datetime, timedelta
+from more_itertools import chunked
+from data_pipeline.managers.steam_api_manager import SteamAPIManager, HOST_RATE_LIMITS
+from data_pipeline.managers.mongo_manager import MongoManager, CRAWL_LEASE_DURATION, FRONTIER_ENDPOINTS
 from data_pipeline.utils.utils_logging import setup_logging
 
 setup_logging()
 logger = logging.getLogger(__name__)
 
-def fetch_and_store_app_names():
+def fetch_and_store_app_names(steam_api_manager: SteamAPIManager = None, mongo_manager: MongoManager = None):
     """Fetch and store app names from Steam API."""
-    steam_api_manager = SteamAPIManager()
-    mongo_manager = MongoManager()
-    app_names = steam_api_manager.get_app_names()
-    mongo_manager.upsert_app_names(app_names)
-
-def get_filtered_appids() -> list:
-    mongo_manager = MongoManager()
-    db = mongo_manager.database
-    names_col = db['names']
-    details_col = db['details']
-    no_details_col = db['no_details']
-    tags_col = db['tags']
-    reviews_col = db['reviews']
-
-    # Step 1: Get all appids from 'names' excluding 'playtest'
-    base_cursor = names_col.find(
-        {"name": {"$not": {"$regex": r"\bplaytest\b", "$options": "i"}}},
-        {"appid": 1, "datetime": 1}
-    )
-    name_docs = [doc for doc in base_cursor]
-    base_appids = [doc["appid"] for doc in name_docs]
-
-    # Step 2: Existing appids from other collections
-    existing_details = set([doc["appid"] for doc in details_col.find({}, {"appid": 1})])
-    existing_no_details = set([doc["appid"] for doc in no_details_col.find({}, {"appid": 1})])
-    existing_tags = set([doc["appid"] for doc in tags_col.find({}, {"appid": 1})])
-    existing_reviews = set([doc["appid"] for doc in reviews_col.find({}, {"appid": 1})])
-
-    details_union = existing_details | existing_no_details
-
-    # Step 3: Score appids based on how many collections they are missing from
-    priority_scores = defaultdict(list)
-    appid_to_datetime = {}
-
-    for doc in name_docs:
-        appid = doc["appid"]
-        appid_to_datetime[appid] = doc.get("datetime", datetime.now())
-        missing_count = 0
-        if appid not in details_union:
-            missing_count += 1
-        if appid not in existing_tags:
-            missing_count += 1
-        if appid not in existing_reviews:
-            missing_count += 1
-
-        priority_scores[missing_count].append(appid)
-
-    # Step 4: Build final sorted list of appids by priority level
-    final_appids = []
-
-    for score in [3, 2, 1]:
-        for appid in priority_scores[score]:
-            if len(final_appids) < 1000:
-                final_appids.append(appid)
-            else:
-                break
-
-    already_selected = set(final_appids)
-
-    # Step 5: Oldest remaining appids by datetime (score = 0)
-    remaining_appids = [
-        (appid, appid_to_datetime[appid])
-        for appid in base_appids
-        if appid not in already_selected
-    ]
+    steam_api_manager = steam_api_manager or SteamAPIManager()
+    mongo_manager = mongo_manager or MongoManager()
+    _use_shared_rate_limiters(steam_api_manager, mongo_manager)
+    mongo_manager.sync_app_names(steam_api_manager.iter_app_names())
 
-    oldest_sorted = sorted(remaining_appids, key=lambda x: x[1])
+def get_filtered_appids(mongo_manager: MongoManager = None, limit: int = 1000) -> list:
+    """Get the next due appids from the crawl frontier."""
+    mongo_manager = mongo_manager or MongoManager()
+    mongo_manager.ensure_frontier_indexes()
+    # First run only: build the frontier from the existing collections. A marker is
+    # needed as the names sync may already have seeded newly listed apps into it
+    if not mongo_manager.get_crawl_state('frontier').get('built_at'):
+        mongo_manager.rebuild_frontier()
 
-    for appid, _ in oldest_sorted:
-        if len(final_appids) < 1000:
-            final_appids.append(appid)
-        else:
-            break
+    appids = mongo_manager.select_due_appids(limit)
+    logger.info(f"Selected {len(appids)} due appids from the frontier")
+    return appids
 
-    return final_appids
-
-def fetch_and_store_app_details(steam_api_manager: SteamAPIManager, mongo_manager: MongoManager, appids: list):
+def fetch_and_store_app_details(steam_api_manager: SteamAPIManager, mongo_manager: MongoManager, appids: list) -> dict:
     """Fetch and store app details for a given appid."""
     logger.info(f"Starting to fetch details for {len(appids)} appids...")
     if not isinstance(appids, list):
         logger.error(f"Expected a list of appids, got {type(appids)}: {appids}")
         raise ValueError("Expected a list of appids.")
 
-    for appid in appids:
-        details = steam_api_manager.get_app_details(appid)
-        mongo_manager.upsert_app_details(appid, details)
+    # Skip apps whose details are not due yet given how often they change
+    frontier = mongo_manager.load_frontier(appids)
+    appids = mongo_manager.filter_due_appids(appids, 'details', frontier)
+    no_details = mongo_manager.load_no_details(appids)
+    content_hashes = mongo_manager.load_content_hashes('details', appids)
+    logger.info(f"{len(appids)} appids are due for a details refresh")
+
+    def operations(appid: int, details: dict) -> list:
+        if details is None:
+            logger.warning(f"JSONDecodeError fetching details for appid {appid}. Skipping this appid.")
+            return []
+        operations = mongo_manager.app_details_operations(
+            appid, details, no_details.get(appid), content_hashes.get(appid)
+        )
+        due_at, is_parked = None, False
+        if not details.get(str(appid), {}).get('data'):
+            # Retry apps without a store page on the negative cache schedule
+            _, due_at, is_parked = mongo_manager.no_details_backoff(no_details.get(appid))
+        operations.append(mongo_manager.frontier_fetched_operation(
+            appid, 'details', details, frontier.get(appid), due_at=due_at, is_parked=is_parked
+        ))
+        return operations
+
+    return _run_crawl(steam_api_manager, mongo_manager, 'details', appids, operations)
 
-def fetch_and_store_app_tags(steam_api_manager: SteamAPIManager, mongo_manager: MongoManager, appids: list):
+def fetch_and_store_app_tags(steam_api_manager: SteamAPIManager, mongo_manager: MongoManager, appids: list) -> dict:
     """Fetch and store app tags for a given appid."""
     logger.info(f"Starting to fetch tags for {len(appids)} appids...")
     if not isinstance(appids, list):
         logger.error(f"Expected a list of appids, got {type(appids)}: {appids}")
         raise ValueError("Expected a list of appids.")
 
-    for appid in appids:
-        tags = steam_api_manager.get_app_tags(appid)
+    # Skip apps whose tags are not due yet given how often they change
+    frontier = mongo_manager.load_frontier(appids)
+    appids = mongo_manager.filter_due_appids(appids, 'tags', frontier)
+    content_hashes = mongo_manager.load_content_hashes('tags', appids)
+    logger.info(f"{len(appids)} appids are due for a tags refresh")
+
+    def operations(appid: int, tags: dict) -> list:
         if tags is None:
             logger.warning(f"JSONDecodeError fetching tags for appid {appid}. Skipping this appid.")
-            continue
-        mongo_manager.upsert_app_tags(appid, tags)
+            return []
+        return [
+            *mongo_manager.app_tags_operations(appid, tags, content_hashes.get(appid)),
+            mongo_manager.frontier_fetched_operation(appid, 'tags', tags, frontier.get(appid)),
+        ]
+
+    return _run_crawl(steam_api_manager, mongo_manager, 'tags', appids, operations)
 
-def fetch_and_store_app_reviews(steam_api_manager: SteamAPIManager, mongo_manager: MongoManager, appids: list):
-    """Fetch and store app reviews for a given appid."""
+def fetch_and_store_app_reviews(
+    steam_api_manager: SteamAPIManager,
+    mongo_manager: MongoManager,
+    appids: list,
+    mode: str = 'html',
+    max_reviews: int = 1000,
+) -> dict:
+    """
+    Fetch and store app reviews for a given appid.
+
+    mode='html' stores the review page of the store, mode='json' pages
+    through the JSON reviews of every app (see `fetch_and_store_review_items`).
+    Only mode='html' reviews are staged into Postgres, json mode is Mongo-only.
+    """
     logger.info(f"Starting to fetch reviews for {len(appids)} appids...")
     if not isinstance(appids, list):
         logger.error(f"Expected a list of appids, got {type(appids)}: {appids}")
         raise ValueError("Expected a list of appids.")
 
-    for appid in appids:
-        reviews = steam_api_manager.get_app_reviews(appid)
-        mongo_manager.upsert_app_reviews(appid, reviews)
\ No newline at end of file
+    # Skip apps whose reviews are not due yet given how often they change
+    frontier = mongo_manager.load_frontier(appids)
+    appids = mongo_manager.filter_due_appids(appids, 'reviews', frontier)
+    logger.info(f"{len(appids)} appids are due for a reviews refresh")
+    if mode == 'json':
+        return fetch_and_store_review_items(steam_api_manager, mongo_manager, appids, frontier, max_reviews)
+    content_hashes = mongo_manager.load_content_hashes('reviews', appids)
+
+    def operations(appid: int, reviews: dict) -> list:
+        if reviews is None:
+            logger.warning(f"JSONDecodeError fetching reviews for appid {appid}. Skipping this appid.")
+            return []
+        return [
+            *mongo_manager.app_reviews_operations(appid, reviews, content_hashes.get(appid)),
+            mongo_manager.frontier_fetched_operation(appid, 'reviews', reviews, frontier.get(appid)),
+        ]
+
+    stats = _run_crawl(steam_api_manager, mongo_manager, 'reviews', appids, operations)
+    if mongo_manager.compress_reviews:
+        stats['compression'] = mongo_manager.compression_summary()
+        logger.info(f"Compressed review fields: {stats['compression']}")
+    return stats
+
+def fetch_and_store_review_items(
+    steam_api_manager: SteamAPIManager,
+    mongo_manager: MongoManager,
+    appids: list,
+    frontier: dict,
+    max_reviews: int = 1000,
+) -> dict:
+    """
+    Page through the JSON reviews of every appid, newest first, writing each
+    page as it arrives and stopping at the newest review already stored.
+    """
+    mongo_manager.ensure_review_item_indexes()
+    latest_timestamps = mongo_manager.load_latest_review_timestamps(appids)
+
+    def add_operations(operations: list):
+        for collection_name, operation in operations:
+            writer.add(collection_name, operation)
+
+    async def store_page(appid: int, reviews: list):
+        # A page can trigger a bulk write, run it in a thread so the event loop keeps fetching
+        await asyncio.to_thread(add_operations, mongo_manager.review_items_operations(appid, reviews))
+
+    def fetch(appid: int):
+        return steam_api_manager.fetch_review_pages(
+            appid, store_page, max_reviews=max_reviews, since=latest_timestamps.get(appid)
+        )
+
+    def operations(appid: int, result: dict) -> list:
+        if result is None:
+            logger.warning(f"No JSON reviews for appid {appid}. Skipping this appid.")
+            return []
+        # The summary changes with every new review, so it drives the refresh schedule
+        return [
+            mongo_manager.review_summary_operation(appid, result['query_summary']),
+            mongo_manager.frontier_fetched_operation(appid, 'reviews', result['query_summary'], frontier.get(appid)),
+        ]
+
+    with mongo_manager.bulk_writer(metrics=steam_api_manager.metrics) as writer:
+        stats = _run_crawl(steam_api_manager, mongo_manager, 'reviews', appids, operations, fetch=fetch)
+    stats['review_items'] = writer.summary()
+    return stats
+
+def get_priced_appids(mongo_manager: MongoManager) -> list:
+    """Get the appids in 'details' that are not free and therefore have a price to refresh."""
+    cursor = mongo_manager.database.details.find({'is_free': False}, {'_id': 0, 'appid': 1})
+    return [doc['appid'] for doc in cursor]
+
+def fetch_and_store_app_prices(steam_api_manager: SteamAPIManager, mongo_manager: MongoManager, appids: list = None, batch_size: int = 100) -> dict:
+    """Refresh only the price_overview of apps, requesting `batch_size` appids per call."""
+    if appids is None:
+        appids = get_priced_appids(mongo_manager)
+    logger.info(f"Starting to refresh prices for {len(appids)} appids in batches of {batch_size}...")
+
+    def operations(batch: list, prices: dict) -> list:
+        if prices is None:
+            logger.warning(f"JSONDecodeError fetching prices for {len(batch)} appids. Skipping this batch.")
+            return []
+        return mongo_manager.app_prices_operations(prices)
+
+    batches = [list(batch) for batch in chunked(appids, batch_size)]
+    return _run_crawl(steam_api_manager, mongo_manager, 'prices', batches, operations)
+
+def probe_parked_apps(steam_api_manager: SteamAPIManager, mongo_manager: MongoManager, limit: int = 1000, batch_size: int = 100) -> dict:
+    """
+    Probe parked apps of the negative cache with batched price-only requests,
+    which report per appid whether a store page exists, and revive those that do.
+    """
+    appids = mongo_manager.select_parked_appids(limit)
+    logger.info(f"Starting to probe {len(appids)} parked appids in batches of {batch_size}...")
+
+    def operations(batch: list, results: dict) -> list:
+        if results is None:
+            logger.warning(f"JSONDecodeError probing {len(batch)} parked appids. Skipping this batch.")
+            return []
+        return mongo_manager.parked_probe_operations(results)
+
+    batches = [list(batch) for batch in chunked(appids, batch_size)]
+    return _run_crawl(steam_api_manager, mongo_manager, 'prices', batches, operations)
+
+def create_crawl_shards(mongo_manager: MongoManager, appids: list, run_id: str, endpoints: list = None, shard_size: int = 100) -> dict:
+    """Split the due appids of a run into leased shards per endpoint."""
+    endpoints = endpoints or ['details', 'tags', 'reviews']
+    return {endpoint: mongo_manager.create_crawl_shards(run_id, endpoint, appids, shard_size) for endpoint in endpoints}
+
+def crawl_shards(
+    endpoint: str,
+    run_id: str,
+    worker_index: int = 0,
+    steam_api_manager: SteamAPIManager = None,
+    mongo_manager: MongoManager = None,
+    fetch_kwargs: dict = None,
+) -> dict:
+    """
+    Claim and crawl shards of `endpoint` until none is left.
+
+    Any number of workers can run this side by side: shards are handed out
+    through leases renewed by a heartbeat, so the shards of a crashed worker
+    are claimed again once its lease expires. A worker without a shard to
+    claim waits as long as another one holds a lease. Shards claimed
+    `CRAWL_LEASE_MAX_ATTEMPTS` times are marked failed, and the worker then
+    raises so the run does not pass with appids left out. All workers draw from the same
+    per-host rate budgets kept in Mongo. `fetch_kwargs` are passed on to the
+    fetch function of the endpoint (e.g. the reviews `mode`).
+    """
+    steam_api_manager = steam_api_manager or SteamAPIManager()
+    mongo_manager = mongo_manager or MongoManager()
+    steam_api_manager.metrics.labels['worker'] = worker_index
+    fetch = {
+        'details': fetch_and_store_app_details,
+        'tags': fetch_and_store_app_tags,
+        'reviews': fetch_and_store_app_reviews,
+    }[endpoint]
+    owner = f"{socket.gethostname()}:{os.getpid()}:{worker_index}"
+    totals = {'shards': 0, 'requested': 0, 'fetched': 0, 'failed': 0}
+    heartbeat_interval = CRAWL_LEASE_DURATION.total_seconds() / 3
+
+    while True:
+        shard = mongo_manager.claim_crawl_shard(run_id, endpoint, owner)
+        if shard is None:
+            mongo_manager.fail_exhausted_crawl_shards(run_id, endpoint)
+            # The shard of a live lease is claimable again if its worker dies
+            expires_at = mongo_manager.next_crawl_lease_expiry(run_id, endpoint)
+            if expires_at is None:
+                break
+            wait = (expires_at - datetime.now()).total_seconds()
+            logger.info(f"Worker {owner} waiting for the leased {endpoint} shards of run {run_id}")
+            time.sleep(min(max(wait, 1), heartbeat_interval))
+            continue
+
+        logger.info(f"Worker {owner} claimed {endpoint} shard {shard['shard']} (attempt {shard['attempts']})")
+        lost = threading.Event()
+        stopped = threading.Event()
+
+        def heartbeat():
+            while not stopped.wait(heartbeat_interval):
+                if not mongo_manager.renew_crawl_lease(shard['_id'], owner):
+                    logger.warning(f"Worker {owner} lost the lease of {endpoint} shard {shard['shard']}")
+                    lost.set()
+                    return
+
+        heartbeat_thread = threading.Thread(target=heartbeat, daemon=True)
+        heartbeat_thread.start()
+        try:
+            stats = fetch(steam_api_manager, mongo_manager, shard['appids'], **(fetch_kwargs or {}))
+        except Exception:
+            # Hand the shard back right away instead of waiting for the lease to expire
+            mongo_manager.release_crawl_shard(shard['_id'], owner)
+            raise
+        finally:
+            stopped.set()
+            heartbeat_thread.join()
+
+        if not lost.is_set():
+            mongo_manager.release_crawl_shard(shard['_id'], owner, {key: stats.get(key) for key in ('requested', 'fetched', 'failed')})
+        totals['shards'] += 1
+        for key in ('requested', 'fetched', 'failed'):
+            totals[key] += stats.get(key, 0)
+
+    totals['metrics'] = steam_api_manager.metrics.summary()
+    logger.info(f"Worker {owner} finished {endpoint}: {totals}")
+    failed_shards = mongo_manager.failed_crawl_shards(run_id, endpoint)
+    if failed_shards:
+        raise RuntimeError(f"{endpoint} shards {failed_shards} of run {run_id} failed and were not crawled")
+    return totals
+
+def _use_shared_rate_limiters(steam_api_manager: SteamAPIManager, mongo_manager: MongoManager) -> None:
+    """Draw requests from the per-host budgets kept in Mongo, shared by every crawl process."""
+    steam_api_manager.rate_limiters.update(mongo_manager.shared_rate_limiters(HOST_RATE_LIMITS))
+
+def _run_crawl(steam_api_manager: SteamAPIManager, mongo_manager: MongoManager, endpoint: str, appids: list, operations, fetch=None) -> dict:
+    """
+    Crawl an endpoint starting from, and saving back, the rate learned by previous runs.
+
+    `operations(key, payload)` turns every response into Mongo write operations,
+    which are buffered and flushed as bulk writes while the crawl goes on. `fetch(key)` replaces the
+    single request per key (see `SteamAPIManager.crawl`).
+    """
+    # Every crawl, not only the sharded workers, shares the per-host budgets
+    _use_shared_rate_limiters(steam_api_manager, mongo_manager)
+    state_key = f"rate:{endpoint}"
+    learned_rate = mongo_manager.get_crawl_state(state_key).get('rate')
+    if learned_rate:
+        steam_api_manager.set_rates({endpoint: learned_rate})
+        logger.info(f"Resuming {endpoint} crawl at learned rate {learned_rate:.3f} req/s")
+
+    def write(key_operations):
+        for collection_name, operation in key_operations:
+            writer.add(collection_name, operation)
+
+    metrics = steam_api_manager.metrics
+    try:
+        with mongo_manager.bulk_writer(metrics=metrics) as writer:
+            # Responses are turned into operations and written in their own stages
+            stats = asyncio.run(steam_api_manager.crawl(
+                endpoint, appids, lambda key, payload: operations(key, payload) or None, fetch=fetch, write=write
+            ))
+    finally:
+        mongo_manager.set_crawl_state(state_key, {'rate': steam_api_manager.get_rates()[endpoint]})
+    stats['writes'] = writer.summary()
+
+    # Telemetry is returned to XCom with the stats and exported for Prometheus
+    metrics.record_stages(endpoint, stats['stages'])
+    stats['metrics'] = metrics.summary()
+    metrics.write_textfile('_'.join(['steam_crawl', endpoint, *map(str, metrics.labels.values())]))
+
+    if stats['deferred']:
+        # The host's circuit is open: retry these apps once it lets requests through
+        logger.warning(f"Deferred {len(stats['deferred'])} {endpoint} requests, the circuit of their host is open")
+        if endpoint in FRONTIER_ENDPOINTS:
+            until = datetime.now() + timedelta(seconds=steam_api_manager.circuit_retry_in(endpoint))
+            mongo_manager.defer_frontier_appids(stats['deferred'], endpoint, until)
+
+    if stats['failed'] and not stats['fetched']:
+        # Fail the task when no request succeeded so Airflow retries it
+        raise RuntimeError(f"All {stats['failed']} {endpoint} requests failed.")
+    return stats
@@ -2,22 +2,22 @@
 from data_pipeline.managers.mongo_manager import MongoManager
 from data_pipeline.managers.postgres_manager import PostgresManager
 from data_pipeline.utils.utils_pipeline import (
-    convert_mixed_columns_to_string,
-    to_pg_array_str_safe,
+    DistinctValueCache,
+    map_distinct,
+    read_documents_df,
+    encode_pg_columns_df,
     remove_html_tags_df,
     normalize_strings_df,
     strip_list_strings_df,
     remove_plus_sign_df,
     convert_age_to_int_df,
     filter_age_df,
-    is_diff_texts
+    is_diff_texts_df
 )
 # Utils
-import json
 from bson import ObjectId
 from more_itertools import chunked
 # Data Science
-import pandas as pd
 import polars as pl
 
 import logging
@@ -30,6 +30,46 @@ warnings.simplefilter("ignore", category=MarkupResemblesLocatorWarning)
 setup_logging()
 logger = logging.getLogger(__name__)
 
+# Declared schema of the details projection. Fields Steam returns with mixed
+# types (e.g. ages as 18 or "18+") are read as String.
+REQUIREMENTS_STRUCT = pl.Struct({'minimum': pl.String, 'recommended': pl.String})
+RATING_AGENCIES = [
+    'dejus', 'steam_germany', 'csrr', 'esrb', 'pegi', 'usk', 'oflc', 'nzoflc', 'kgrb',
+    'mda', 'fpb', 'crl', 'bbfc', 'cero', 'agcom', 'cadpa', 'video',
+]
+DETAILS_SCHEMA = {
+    # Key
+    'appid': pl.Int64, 'name': pl.String, 'fullgame': pl.Struct({'appid': pl.String}),
+    # Description
+    'about_the_game': pl.String, 'detailed_description': pl.String, 'short_description': pl.String,
+    # Images
+    'header_image': pl.String, 'background_raw': pl.String,
+    'screenshots': pl.List(pl.Struct({'path_full': pl.String})),
+    'movies': pl.List(pl.Struct({'mp4': pl.Struct({'max': pl.String})})),
+    # Price
+    'is_free': pl.Boolean, 'price_overview': pl.Struct({'currency': pl.String, 'initial': pl.Int64}),
+    # Meta
+    'type': pl.String,
+    'categories': pl.List(pl.Struct({'description': pl.String})),
+    'genres': pl.List(pl.Struct({'description': pl.String})),
+    'supported_languages': pl.String, 'controller_support': pl.String,
+    # Date
+    'release_date': pl.Struct({'date': pl.String}),
+    # Contract
+    'developers': pl.List(pl.String), 'publishers': pl.List(pl.String),
+    'content_descriptors': pl.Struct({'notes': pl.String}),
+    # Progress
+    'achievements': pl.Struct({'highlighted': pl.List(pl.Struct({'name': pl.String, 'path': pl.String}))}),
+    # Computer Specs
+    'platforms': pl.Struct({'windows': pl.Boolean, 'mac': pl.Boolean, 'linux': pl.Boolean}),
+    'pc_requirements': REQUIREMENTS_STRUCT,
+    'mac_requirements': REQUIREMENTS_STRUCT,
+    'linux_requirements': REQUIREMENTS_STRUCT,
+    # Required Age
+    'required_age': pl.String,
+    'ratings': pl.Struct({agency: pl.Struct({'required_age': pl.String}) for agency in RATING_AGENCIES}),
+}
+
 
 def get_stg_details_filtered_ids(mongo_manager: MongoManager) -> list:
     """Get the list of filtered IDs for the 'details' collection in MongoDB."""
@@ -38,7 +78,9 @@ def get_stg_details_filtered_ids(mongo_manager: MongoManager) -> list:
         # Filter type in the list
         'type': {'$in': ['game', 'dlc', 'demo', 'series', 'episode', 'music', 'mod']},
         # Filter only already published apps
-        'release_date.coming_soon': False
+        'release_date.coming_soon': False,
+        # Only documents whose content changed since the last staging run
+        **mongo_manager.begin_stage('details', 'details'),
     }
 
     # Read only necessary columns
@@ -54,6 +96,17 @@ def get_stg_details_filtered_ids(mongo_manager: MongoManager) -> list:
     print(f"Number of documents: {len(list_cursor)}")
     return [str(document['_id']) for document in list_cursor]
 
+def parse_release_dates(dates: pl.Series) -> pl.Series:
+    """Parse the date formats Steam uses across store languages."""
+    return dates.to_frame("date").select(
+        pl.coalesce([
+            pl.col("date").str.to_titlecase().str.strptime(pl.Date, "%d %b %Y", strict=False), # 1 Jan 2025
+            pl.col("date").str.to_titlecase().str.strptime(pl.Date, "%d. %b. %Y", strict=False), # 1. Jan. 2025
+            pl.col("date").str.strptime(pl.Date, "%d %b, %Y", strict=False), # 1 Jan, 2025
+            pl.col("date").str.strptime(pl.Date, "%b %d, %Y", strict=False), # Jan 1, 2025
+        ])
+    ).to_series()
+
 def process_stg_details_filtered(mongo_manager: MongoManager, postgres_manager: PostgresManager, filtered_str_ids: list) -> None:
     """Process the filtered details from MongoDB and insert into Postgres."""
     logger.info(f"Starting processing of {len(filtered_str_ids)} filtered details...")
@@ -63,6 +116,9 @@ def process_stg_details_filtered(mongo_manager: MongoManager, postgres_manager:
     # Define the batch size for processing
     batch_size = 1000
     logger.info(f"Processing in batches of {batch_size}...")
+    # Cleaned values of repetitive columns are reused across batches
+    html_cache = DistinctValueCache()
+    date_cache = DistinctValueCache()
     # Read only necessary columns
     projection = {
         '_id': 0,
@@ -103,27 +159,9 @@ def process_stg_details_filtered(mongo_manager: MongoManager, postgres_manager:
         cursor = mongo_manager.database.details.find({'_id': {'$in': ids}}, projection)
         list_cursor = list(cursor)
 
-        # Convert to DataFrame
-        df = pd.json_normalize(list_cursor)
-        # logger.info("JSON normalized and loaded dataframe...")
-        
-        # Convert mixed columns to string
-        df_cleaned = convert_mixed_columns_to_string(df)
-        # logger.info("Converted mixed columns to string...")
-        
-        # Convert to Polars LazyFrame
-        df_pl = pl.LazyFrame(
-            df_cleaned,
-            strict=False,
-            infer_schema_length=batch_size
-        )
-        # logger.info("Converted DataFrame to Polars LazyFrame...")
-        
-        # Drop unnecessary columns early
-        columns_to_drop = ['pc_requirements', 'mac_requirements', 'linux_requirements', 'ratings']
-        columns_to_drop_in_df = [col for col in columns_to_drop if col in df_pl.collect_schema().names()]
-        df_pl = df_pl.drop(columns_to_drop_in_df)
-        # logger.info(f"Dropped unnecessary columns: {columns_to_drop_in_df}")
+        # Load into Polars with the declared schema, nested fields as dotted columns
+        df_pl = read_documents_df(list_cursor, DETAILS_SCHEMA)
+        # logger.info("Loaded documents into Polars LazyFrame...")
 
         # Basic filters with a single condition is done in MongoDB but multiple conditions will be done in polars
         columns_except_appid = [col for col in df_pl.collect_schema().names() if col != 'appid']
@@ -185,7 +223,7 @@ def process_stg_details_filtered(mongo_manager: MongoManager, postgres_manager:
             df_type_optimized
             # Normalize all strings
             .pipe(normalize_strings_df, cols=cols_str)
-            .pipe(remove_html_tags_df, cols=cols_str)
+            .pipe(remove_html_tags_df, cols=cols_str, cache=html_cache)
             
             # Strip all list strings
             .pipe(strip_list_strings_df, cols=cols_list_string)
@@ -217,14 +255,7 @@ def process_stg_details_filtered(mongo_manager: MongoManager, postgres_manager:
         df_merged_descriptions = (
             df_merged_ages
             # Compute if descriptions are different
-            .with_columns(
-                pl.struct(["about_the_game", "detailed_description"])
-                .map_elements(
-                    lambda x: is_diff_texts(x["about_the_game"], x["detailed_description"]), 
-                    return_dtype=pl.Boolean
-                )
-                .alias("desc_has_diff")
-            )
+            .pipe(is_diff_texts_df, a="about_the_game", b="detailed_description", alias="desc_has_diff")
 
             # Merge descriptions based on logic
             .with_columns(
@@ -309,12 +340,10 @@ def process_stg_details_filtered(mongo_manager: MongoManager, postgres_manager:
         df_cleaned_dates = (
             df_merged_descriptions
             .with_columns(
-                pl.coalesce([
-                    pl.col("release_date.date").str.to_titlecase().str.strptime(pl.Date, "%d %b %Y", strict=False), # 1 Jan 2025
-                    pl.col("release_date.date").str.to_titlecase().str.strptime(pl.Date, "%d. %b. %Y", strict=False), # 1. Jan. 2025
-                    pl.col("release_date.date").str.strptime(pl.Date, "%d %b, %Y", strict=False), # 1 Jan, 2025
-                    pl.col("release_date.date").str.strptime(pl.Date, "%b %d, %Y", strict=False), # Jan 1, 2025
-                ]).alias("release_date.date")
+                pl.col("release_date.date").map_batches(
+                    lambda s: map_distinct(s, parse_release_dates, pl.Date, cache=date_cache, vectorized=True),
+                    return_dtype=pl.Date,
+                ).alias("release_date.date")
             )
             .with_columns(
                 ~(pl.col("release_date.date").is_not_null())
@@ -532,24 +561,18 @@ def process_stg_details_filtered(mongo_manager: MongoManager, postgres_manager:
         # logger.info("Final DataFrame prepared with correct schema (rename & reorder columns)...")
         
         # Clean for Postgres insertion
-        # Convert to Python-native list of dicts
-        df_dicts = df_final.collect().to_dicts()
-
-        for row in df_dicts:
-            for key, value in row.items():
-                if isinstance(value, list) and all(isinstance(v, str) for v in value):
-                    row[key] = to_pg_array_str_safe(value)
-                elif isinstance(value, (list, dict)):
-                    row[key] = json.dumps(value, ensure_ascii=False)
+        # Encode lists as Postgres arrays and nested values as JSON
+        df_final_cleaned = df_final.pipe(encode_pg_columns_df).collect()
         # logger.info("Converted DataFrame to match Postgres insertion expectations...")
 
-        # Convert back to Polars DataFrame
-        df_final_cleaned = pl.DataFrame(df_dicts, infer_schema_length=batch_size)
-
         # Insert into Postgres
         postgres_manager.upsert_app_details(df_final_cleaned)
         logger.info(f"Inserted {len(df_final_cleaned)} rows into Postgres successfully...")
 
+    logger.info(f"HTML cleaning cache: {html_cache.stats()}")
+    logger.info(f"Release date cache: {date_cache.stats()}")
+    mongo_manager.commit_stage('details')
+
 if __name__ == "__main__":
     import os
     from dotenv import load_dotenv
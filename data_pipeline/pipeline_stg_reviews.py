@@ -1,8 +1,9 @@
 # Managers
-from data_pipeline.managers.mongo_manager import MongoManager
+from data_pipeline.managers.mongo_manager import MongoManager, COMPRESSED_REVIEW_FIELDS, decompress_blob
 from data_pipeline.managers.postgres_manager import PostgresManager
 from data_pipeline.utils.utils_pipeline import (
-    to_pg_array_str_safe,
+    DistinctValueCache,
+    encode_pg_columns_df,
     normalize_strings_df,
     parse_steam_review_html_df,
     parse_steam_review_score_df,
@@ -10,7 +11,6 @@ from data_pipeline.utils.utils_pipeline import (
 from data_pipeline.utils.utils_logging import setup_logging
 
 # Utils
-import json
 from bson import ObjectId
 from more_itertools import chunked
 
@@ -48,10 +48,16 @@ def get_stg_reviews_filtered_appids(mongo_manager: MongoManager) -> list:
     list_cursor = [document['appid'] for document in cursor]
 
     # Fetch reviews ids for the filtered appids
-    cursor_reviews = mongo_manager.database.reviews.find(
-        {"appid": {"$in": list_cursor}},
-        {"_id": 0, "appid": 1}
-    )
+    # Only documents whose content changed since the last staging run,
+    # or of apps whose details changed since then (e.g. became eligible).
+    # Apps crawled with STEAM_REVIEWS_MODE=json only have a 'query_summary'
+    # here, their reviews stay in 'review_items' which is not staged
+    reviews_query = {"appid": {"$in": list_cursor}, "html": {"$exists": True}}
+    stage_filter = mongo_manager.begin_stage('reviews', 'reviews')
+    if stage_filter:
+        changed_details = mongo_manager.database.details.find({**query, **stage_filter}, projection)
+        reviews_query["$or"] = [stage_filter, {"appid": {"$in": [document['appid'] for document in changed_details]}}]
+    cursor_reviews = mongo_manager.database.reviews.find(reviews_query, {"_id": 0, "appid": 1})
     list_cursor = [document['appid'] for document in cursor_reviews]
     return list_cursor
 
@@ -66,49 +72,43 @@ def process_stg_reviews_filtered(mongo_manager: MongoManager, postgres_manager:
     projection = {
         "_id": 0, "appid": 1, "html": 1, "review_score": 1
     }
+    # Review score snippets repeat across apps and batches
+    review_score_cache = DistinctValueCache()
 
     for batch_index, appids in enumerate(chunked(filtered_appids, batch_size), start=1):
         logger.info(f"Processing batch {batch_index} with {len(appids)} appids")
         # Fetch documents
-        cursor = mongo_manager.database.reviews.find({'appid': {'$in': appids}}, projection)
+        cursor = mongo_manager.database.reviews.find({'appid': {'$in': appids}, 'html': {'$exists': True}}, projection)
         list_cursor = list(cursor)
+        if not list_cursor:
+            logger.info(f"No reviews pages left in batch {batch_index}, skipping")
+            continue
+
+        # Fragments stored compressed are read back as plain strings
+        for document in list_cursor:
+            for field in COMPRESSED_REVIEW_FIELDS:
+                if field in document:
+                    document[field] = decompress_blob(document[field])
         
         df = pl.LazyFrame(list_cursor, strict=False, infer_schema_length=len(list_cursor))
+        # A field missing from every document of the batch is still a typed column
+        missing_cols = [col for col in ['html', 'review_score'] if col not in df.collect_schema().names()]
         
         df_final = (
             df
+            .with_columns([pl.lit(None, dtype=pl.String).alias(col) for col in missing_cols])
             .pipe(normalize_strings_df, cols=['html', 'review_score'])
             .pipe(parse_steam_review_html_df, col='html')
-            .pipe(parse_steam_review_score_df, col='review_score')
+            .pipe(parse_steam_review_score_df, col='review_score', cache=review_score_cache)
         )
 
-        df_dicts = df_final.collect().to_dicts()
-
-        for row in df_dicts:
-            for key, value in row.items():
-
-                # Case 1: Convert [] to None
-                if isinstance(value, list):
-                    if value == []:
-                        row[key] = None
-
-                    elif all(isinstance(v, str) for v in value):
-                        row[key] = to_pg_array_str_safe(value)
-
-                    else:
-                        row[key] = json.dumps(value, ensure_ascii=False)
-
-                # Case 2: Convert {"a": None, "b": None} to None
-                elif isinstance(value, dict):
-                    if all(v is None for v in value.values()):
-                        row[key] = None
-                    else:
-                        row[key] = json.dumps(value, ensure_ascii=False)
+        # Encode nested values for Postgres: [] and all-null structs become None
+        df_final_cleaned = df_final.pipe(encode_pg_columns_df, empty_list_as_null=True, null_struct_as_null=True).collect()
         logger.info("Converted DataFrame to match Postgres insertion expectations...")
 
-        # Convert back to Polars DataFrame
-        df_final_cleaned = pl.DataFrame(df_dicts, strict=False, infer_schema_length=len(list_cursor))
-        
         # Insert into Postgres
         postgres_manager.upsert_app_reviews(df_final_cleaned)
         logger.info(f"Inserted {len(df_final_cleaned)} rows into Postgres successfully...")
+
+    logger.info(f"Review score cache: {review_score_cache.stats()}")
+    mongo_manager.commit_stage('reviews')
@@ -2,10 +2,9 @@
 from data_pipeline.managers.mongo_manager import MongoManager
 from data_pipeline.managers.postgres_manager import PostgresManager
 from data_pipeline.utils.utils_pipeline import (
-    to_pg_array_str_safe,
+    encode_pg_columns_df,
 )
 # Utils
-import json
 from bson import ObjectId
 from more_itertools import chunked
 # Data Science
@@ -25,17 +24,18 @@ logger = logging.getLogger(__name__)
 def get_stg_tags_filtered_ids(mongo_manager: MongoManager) -> list:
     """Get the list of filtered IDs for the 'details' collection in MongoDB."""
     # Fetch game appids
-    cursor_details = mongo_manager.database.details.find(
-        {"type": "game", "release_date.coming_soon": False},
-        {"_id": 0, "appid": 1}
-    )
+    details_query = {"type": "game", "release_date.coming_soon": False}
+    cursor_details = mongo_manager.database.details.find(details_query, {"_id": 0, "appid": 1})
     game_appids = [doc['appid'] for doc in cursor_details]
 
-    
-    cursor_tags = mongo_manager.database.tags.find(
-        {"appid": {"$in": game_appids}},
-        {"_id": 1}
-    )
+    # Only documents whose content changed since the last staging run,
+    # or of apps whose details changed since then (e.g. became eligible)
+    query = {"appid": {"$in": game_appids}}
+    stage_filter = mongo_manager.begin_stage('tags', 'tags')
+    if stage_filter:
+        changed_details = mongo_manager.database.details.find({**details_query, **stage_filter}, {"_id": 0, "appid": 1})
+        query["$or"] = [stage_filter, {"appid": {"$in": [doc['appid'] for doc in changed_details]}}]
+    cursor_tags = mongo_manager.database.tags.find(query, {"_id": 1})
     list_cursor = list(cursor_tags)
 
     # Print count of documents
@@ -69,19 +69,12 @@ def process_stg_tags_filtered(mongo_manager: MongoManager, postgres_manager: Pos
         df = pl.LazyFrame(list_cursor, strict=False, infer_schema_length=len(list_cursor))
         df_filtered = df.filter(pl.col('tags').list.len() > 0)
 
-        df_dicts = df_filtered.collect().to_dicts()
-
-        for row in df_dicts:
-            for key, value in row.items():
-                if isinstance(value, list) and all(isinstance(v, str) for v in value):
-                    row[key] = to_pg_array_str_safe(value)
-                elif isinstance(value, (list, dict)):
-                    row[key] = json.dumps(value, ensure_ascii=False)
+        # Encode lists as Postgres arrays and nested values as JSON
+        df_final_cleaned = df_filtered.pipe(encode_pg_columns_df).collect()
         # logger.info("Converted DataFrame to match Postgres insertion expectations...")
-
-        # Convert back to Polars DataFrame
-        df_final_cleaned = pl.DataFrame(df_dicts, infer_schema_length=len(list_cursor))
         
         # Insert into Postgres
         postgres_manager.upsert_app_tags(df_final_cleaned)
         logger.info(f"Inserted {len(df_final_cleaned)} rows into Postgres successfully...")
+
+    mongo_manager.commit_stage('tags')
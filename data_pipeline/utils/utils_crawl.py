@@ -0,0 +1,562 @@
+import os
+import re
+import gzip
+import json
+import math
+import time
+import hashlib
+import codecs
+import asyncio
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable, Iterator, Optional
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+
+
+#--------------------------------------
+# Rate Limiting
+#--------------------------------------
+class TokenBucket:
+    """Token bucket that paces requests sent to a single host."""
+
+    def __init__(self, rate: float, capacity: int = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Take a token and return the seconds to wait before it can be used."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            # Tokens may go negative: the debt is the queue of callers already waiting
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def wait(self) -> None:
+        """Block the current thread until a token is available."""
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire(self) -> None:
+        """Suspend the current coroutine until a token is available."""
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class AIMDRateController:
+    """
+    Additive-increase/multiplicative-decrease pacing for a single endpoint.
+
+    Every success raises the rate by `increase` requests per second, every
+    throttled response (429/5xx) multiplies it by `decrease`. A `Retry-After`
+    pause holds back all requests of the endpoint until it has passed.
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        rate: float,
+        min_rate: float = 0.05,
+        max_rate: float = 5.0,
+        increase: float = 0.02,
+        decrease: float = 0.5,
+    ):
+        self.endpoint = endpoint
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.rate = min(max(rate, min_rate), max_rate)
+        self.successes = 0
+        self.throttles = 0
+        self.next_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Claim the next request slot and return the seconds to wait for it."""
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self.next_at)
+            self.next_at = start + 1 / self.rate
+            return start - now
+
+    def wait(self) -> None:
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire(self) -> None:
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def on_success(self) -> None:
+        with self._lock:
+            self.successes += 1
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_throttle(self, pause: float = 0.0) -> None:
+        """Back off after a 429/5xx, pausing the endpoint for `pause` seconds."""
+        with self._lock:
+            self.throttles += 1
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self.next_at = max(self.next_at, time.monotonic() + pause)
+
+    def snapshot(self) -> dict:
+        return {
+            'endpoint': self.endpoint,
+            'rate': round(self.rate, 4),
+            'successes': self.successes,
+            'throttles': self.throttles,
+        }
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a `Retry-After` header given either in seconds or as an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+#--------------------------------------
+# Circuit Breaking
+#--------------------------------------
+class CircuitOpenError(Exception):
+    """Raised instead of sending a request to a host whose circuit is open."""
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker of a single host driven by its rolling error rate.
+
+    closed      requests flow, outcomes fill a window of the last `window` requests
+    open        once at least `min_requests` outcomes are known and the error rate
+                reaches `error_rate`: requests fail fast for `cooldown` seconds
+    half_open   after the cooldown a single probe request is let through,
+                its success closes the circuit and its failure opens it again
+    """
+
+    def __init__(self, host: str, window: int = 20, error_rate: float = 0.5, min_requests: int = 10, cooldown: float = 60.0):
+        self.host = host
+        self.error_rate = error_rate
+        self.min_requests = min_requests
+        self.cooldown = cooldown
+        self.outcomes = deque(maxlen=window)
+        self.state = 'closed'
+        self.opened_at = 0.0
+        self.probing = False
+        self.logger = logging.getLogger("CircuitBreaker")
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Whether a request may be sent now."""
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = 'half_open'
+                self.logger.info(f"Circuit of {self.host} half-open, probing")
+            if self.state == 'half_open' and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    def check(self) -> None:
+        if not self.allow():
+            raise CircuitOpenError(f"Circuit of {self.host} is {self.state}")
+
+    def retry_in(self) -> float:
+        """Seconds until the circuit lets a probe through."""
+        return max(0.0, self.cooldown - (time.monotonic() - self.opened_at)) if self.state == 'open' else 0.0
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.state == 'half_open':
+                self.logger.info(f"Circuit of {self.host} closed")
+                self.state = 'closed'
+                self.probing = False
+                self.outcomes.clear()
+            self.outcomes.append(True)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.outcomes.append(False)
+            if self.state == 'half_open':
+                self._open()
+            elif self.state == 'closed' and len(self.outcomes) >= self.min_requests:
+                errors = self.outcomes.count(False)
+                if errors / len(self.outcomes) >= self.error_rate:
+                    self._open()
+
+    def _open(self) -> None:
+        self.state = 'open'
+        self.opened_at = time.monotonic()
+        self.probing = False
+        self.logger.warning(f"Circuit of {self.host} opened for {self.cooldown:.0f}s")
+
+
+#--------------------------------------
+# Staged Pipeline
+#--------------------------------------
+@dataclass
+class Stage:
+    """
+    A step of a `StagedPipeline`. `func(item)` returns the item handed to the
+    next stage, None drops it. Coroutine functions run on the event loop,
+    `blocking` functions in worker threads, others inline on the loop.
+    """
+    name: str
+    func: Callable[[Any], Any]
+    concurrency: int = 1
+    blocking: bool = False
+
+
+class StagedPipeline:
+    """
+    Run items through stages connected by bounded queues so every stage works
+    at the same time, e.g. fetching the next responses while earlier ones are
+    transformed and written. A full queue makes the stage before it wait
+    (backpressure), which keeps memory bounded by `queue_size` per stage.
+
+    An exception raised by a stage cancels the pipeline and is re-raised.
+    """
+
+    _DONE = object()
+
+    def __init__(self, stages: list, queue_size: int = 64):
+        self.stages = stages
+        self.queue_size = queue_size
+        self.metrics = {
+            stage.name: {
+                'concurrency': stage.concurrency,
+                'processed': 0, 'dropped': 0,
+                'busy_seconds': 0.0, 'blocked_seconds': 0.0,
+                'max_queue_depth': 0, 'queue_depth_sum': 0,
+            }
+            for stage in stages
+        }
+
+    async def run(self, items: Iterable) -> dict:
+        """Feed `items` to the first stage and return the metrics of every stage."""
+        queues = [asyncio.Queue(maxsize=self.queue_size) for _ in self.stages]
+        started_at = time.perf_counter()
+
+        async def feed():
+            for item in items:
+                await self._put(queues[0], item, self.metrics[self.stages[0].name], None)
+            for _ in range(self.stages[0].concurrency):
+                await queues[0].put(self._DONE)
+
+        async def work(index: int, stage: Stage):
+            metrics = self.metrics[stage.name]
+            output = queues[index + 1] if index + 1 < len(self.stages) else None
+            while (item := await queues[index].get()) is not self._DONE:
+                began_at = time.perf_counter()
+                if stage.blocking:
+                    result = await asyncio.to_thread(stage.func, item)
+                else:
+                    result = stage.func(item)
+                    if asyncio.iscoroutine(result):
+                        result = await result
+                metrics['busy_seconds'] += time.perf_counter() - began_at
+                metrics['processed'] += 1
+                if output is None:
+                    continue
+                if result is None:
+                    metrics['dropped'] += 1
+                else:
+                    await self._put(output, result, self.metrics[self.stages[index + 1].name], metrics)
+
+        async def run_stage(index: int, stage: Stage):
+            await asyncio.gather(*(work(index, stage) for _ in range(stage.concurrency)))
+            # The next stage stops once every worker of this one is done
+            if index + 1 < len(self.stages):
+                for _ in range(self.stages[index + 1].concurrency):
+                    await queues[index + 1].put(self._DONE)
+
+        tasks = [asyncio.ensure_future(feed())]
+        tasks += [asyncio.ensure_future(run_stage(index, stage)) for index, stage in enumerate(self.stages)]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        elapsed = time.perf_counter() - started_at
+        for metrics in self.metrics.values():
+            queue_depth_sum = metrics.pop('queue_depth_sum')
+            metrics['occupancy'] = round(metrics['busy_seconds'] / (metrics['concurrency'] * elapsed), 4) if elapsed else None
+            metrics['items_per_second'] = round(metrics['processed'] / elapsed, 2) if elapsed else None
+            metrics['mean_queue_depth'] = round(queue_depth_sum / metrics['processed'], 2) if metrics['processed'] else 0.0
+            metrics['busy_seconds'] = round(metrics['busy_seconds'], 3)
+            metrics['blocked_seconds'] = round(metrics['blocked_seconds'], 3)
+        return self.metrics
+
+    async def _put(self, queue: asyncio.Queue, item, consumer_metrics: dict, producer_metrics: Optional[dict]) -> None:
+        depth = queue.qsize()
+        consumer_metrics['queue_depth_sum'] += depth
+        consumer_metrics['max_queue_depth'] = max(consumer_metrics['max_queue_depth'], depth)
+        if queue.full() and producer_metrics is not None:
+            # Time the producing stage spends waiting on a full queue
+            began_at = time.perf_counter()
+            await queue.put(item)
+            producer_metrics['blocked_seconds'] += time.perf_counter() - began_at
+        else:
+            await queue.put(item)
+
+
+#--------------------------------------
+# Streaming JSON
+#--------------------------------------
+def iter_json_array(chunks: Iterable[bytes], key: str) -> Iterator:
+    """
+    Incrementally parse the items of the first JSON array stored under `key`
+    from a stream of UTF-8 chunks, keeping only the unparsed tail in memory.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    marker = f'"{key}"'
+    separators = re.compile(r'[\s,]*')
+    buffer = ''
+    in_array = False
+
+    for chunk in chunks:
+        buffer += text_decoder.decode(chunk)
+
+        if not in_array:
+            start = buffer.find(marker)
+            if start == -1:
+                # Keep enough of the tail to match a marker split across chunks
+                buffer = buffer[-len(marker):]
+                continue
+            bracket = buffer.find('[', start + len(marker))
+            if bracket == -1:
+                buffer = buffer[start:]
+                continue
+            buffer = buffer[bracket + 1:]
+            in_array = True
+
+        position = 0
+        while True:
+            position = separators.match(buffer, position).end()
+            if position >= len(buffer):
+                break
+            if buffer[position] == ']':
+                return
+            try:
+                item, position_end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # The item continues in the next chunk
+                break
+            yield item
+            position = position_end
+        buffer = buffer[position:]
+
+    if in_array:
+        raise ValueError(f"JSON array '{key}' ended unexpectedly")
+    raise ValueError(f"JSON array '{key}' not found")
+
+
+#--------------------------------------
+# Response Cache
+#--------------------------------------
+class CacheMiss(LookupError):
+    """Raised in replay mode when a response is not in the cache."""
+
+
+class ResponseCache:
+    """
+    On-disk cache of gzip-compressed response bodies.
+
+    Entries live at `<cache_dir>/<endpoint>/<request digest>/<time bucket>.gz`
+    where the digest covers the URL and sorted query parameters and the time
+    bucket is the current time divided by `ttl`, so an entry is only served
+    within the bucket it was written in.
+
+    Modes:
+        off         never read nor write
+        read_write  serve entries of the current bucket, store new responses
+        replay      serve the newest entry whatever its age, never touch the
+                    network (a missing entry raises `CacheMiss`) nor the disk
+    """
+
+    MODES = ('off', 'read_write', 'replay')
+
+    def __init__(self, cache_dir: Optional[str], mode: str = 'off', ttl: float = 86400, max_bytes: int = 2 * 1024 ** 3):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown cache mode: {mode}")
+        if mode != 'off' and not cache_dir:
+            raise ValueError(f"Cache mode '{mode}' requires a cache directory")
+        self.cache_dir = cache_dir
+        self.mode = mode
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.stats = {'hits': 0, 'misses': 0, 'writes': 0, 'evicted': 0}
+        self.logger = logging.getLogger("ResponseCache")
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != 'off'
+
+    def _entry_dir(self, endpoint: str, url: str, params: Optional[dict]) -> str:
+        request = json.dumps([url, sorted((params or {}).items())], separators=(',', ':'), default=str)
+        digest = hashlib.blake2b(request.encode('utf-8'), digest_size=16).hexdigest()
+        return os.path.join(self.cache_dir, endpoint, digest)
+
+    def _lookup(self, endpoint: str, url: str, params: Optional[dict]) -> Optional[str]:
+        entry_dir = self._entry_dir(endpoint, url, params)
+        if self.mode == 'replay':
+            try:
+                buckets = sorted(name for name in os.listdir(entry_dir) if name.endswith('.gz'))
+            except FileNotFoundError:
+                buckets = []
+            path = os.path.join(entry_dir, buckets[-1]) if buckets else None
+        else:
+            path = os.path.join(entry_dir, f"{int(time.time() // self.ttl)}.gz")
+            path = path if os.path.exists(path) else None
+
+        if path is None:
+            self.stats['misses'] += 1
+            if self.mode == 'replay':
+                raise CacheMiss(f"No cached {endpoint} response for {url} {params or ''}")
+            return None
+        self.stats['hits'] += 1
+        return path
+
+    def get(self, endpoint: str, url: str, params: Optional[dict] = None) -> Optional[bytes]:
+        """Cached body of a request, None on a miss outside of replay mode."""
+        if not self.enabled:
+            return None
+        path = self._lookup(endpoint, url, params)
+        if path is None:
+            return None
+        with gzip.open(path, 'rb') as file:
+            return file.read()
+
+    def iter_chunks(self, endpoint: str, url: str, params: Optional[dict] = None, chunk_size: int = 64 * 1024) -> Optional[Iterator[bytes]]:
+        """Stream a cached body in chunks, None on a miss outside of replay mode."""
+        if not self.enabled:
+            return None
+        path = self._lookup(endpoint, url, params)
+        if path is None:
+            return None
+
+        def chunks():
+            with gzip.open(path, 'rb') as file:
+                while chunk := file.read(chunk_size):
+                    yield chunk
+        return chunks()
+
+    @contextmanager
+    def writer(self, endpoint: str, url: str, params: Optional[dict] = None):
+        """
+        Yield a file to stream a body into, or None when nothing is stored.
+        The entry only appears once the block exits without an error.
+        """
+        if self.mode != 'read_write':
+            yield None
+            return
+        entry_dir = self._entry_dir(endpoint, url, params)
+        os.makedirs(entry_dir, exist_ok=True)
+        path = os.path.join(entry_dir, f"{int(time.time() // self.ttl)}.gz")
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with gzip.open(temp_path, 'wb', compresslevel=6) as file:
+                yield file
+            os.replace(temp_path, path)
+            self.stats['writes'] += 1
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def put(self, endpoint: str, url: str, params: Optional[dict], body: bytes) -> None:
+        with self.writer(endpoint, url, params) as file:
+            if file is not None:
+                file.write(body)
+
+    def evict(self) -> None:
+        """Drop entries older than `ttl`, then the oldest ones above `max_bytes`."""
+        if self.mode != 'read_write' or not os.path.isdir(self.cache_dir):
+            return
+        expires_before = time.time() - self.ttl
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if stat.st_mtime < expires_before:
+                    self._remove(path)
+                else:
+                    entries.append((stat.st_mtime, stat.st_size, path))
+
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            self._remove(path)
+            total_bytes -= size
+        self.logger.info(f"Cache stats: {self.stats}, size: {total_bytes / 1024 ** 2:.1f} MiB")
+
+    def _remove(self, path: str) -> None:
+        try:
+            os.remove(path)
+            self.stats['evicted'] += 1
+        except FileNotFoundError:
+            pass
+
+
+#--------------------------------------
+# Refresh Scheduling
+#--------------------------------------
+def content_hash(payload) -> str:
+    """Stable hash of a JSON payload, independent of key order."""
+    serialized = json.dumps(payload, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+    return hashlib.blake2b(serialized.encode('utf-8'), digest_size=16).hexdigest()
+
+def estimate_refresh_interval(history: list, floor: timedelta, ceiling: timedelta, default: timedelta) -> timedelta:
+    """
+    Refresh interval of an app endpoint from its refetch history, a list of
+    {'seconds': since previous fetch, 'changed': bool}.
+
+    The change rate uses the Cho & Garcia-Molina estimator for a Poisson
+    process observed at regular intervals, -log((n - X + 0.5) / (n + 0.5)) / I,
+    and the app is refreshed once per expected change. The interval at most
+    doubles per refetch so a few unchanged fetches do not jump to the ceiling.
+    """
+    if not history:
+        return min(max(default, floor), ceiling)
+
+    checks = len(history)
+    changes = sum(1 for entry in history if entry['changed'])
+    mean_seconds = sum(entry['seconds'] for entry in history) / checks
+    if mean_seconds <= 0:
+        return min(max(default, floor), ceiling)
+
+    change_rate = -math.log((checks - changes + 0.5) / (checks + 0.5)) / mean_seconds
+    interval_seconds = 2 * mean_seconds
+    if change_rate > 0:
+        interval_seconds = min(interval_seconds, 1 / change_rate)
+    return min(max(timedelta(seconds=interval_seconds), floor), ceiling)
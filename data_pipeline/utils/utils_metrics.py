@@ -0,0 +1,177 @@
+import os
+import threading
+from collections import defaultdict
+from typing import Optional
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    """Cumulative histogram in the Prometheus layout (bucket counts include smaller buckets)."""
+
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket holding the `q` quantile."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        for bound, count in zip(self.buckets, self.counts):
+            if count >= rank:
+                return bound
+        return float('inf')
+
+    def snapshot(self) -> dict:
+        # Quantiles above the last bucket are reported as '+Inf' to stay JSON-serializable
+        p50, p95 = (self.quantile(q) for q in (0.5, 0.95))
+        return {
+            'count': self.count,
+            'mean': round(self.sum / self.count, 4) if self.count else None,
+            'p50': '+Inf' if p50 == float('inf') else p50,
+            'p95': '+Inf' if p95 == float('inf') else p95,
+        }
+
+
+class CrawlMetrics:
+    """
+    Request and write telemetry of a crawl process, broken down by endpoint
+    and collection. Counters are cumulative like Prometheus counters.
+    """
+
+    def __init__(self, labels: dict = None):
+        self.labels = labels or {}
+        self._lock = threading.Lock()
+        self.latency = defaultdict(Histogram)
+        self.status_counts = defaultdict(lambda: defaultdict(int))
+        self.counters = defaultdict(lambda: {'retries': 0, 'backoff_seconds': 0.0, 'rate_wait_seconds': 0.0, 'bytes': 0})
+        self.write_latency = defaultdict(Histogram)
+        self.write_operations = defaultdict(int)
+        self.stage_throughput = {}
+
+    # -----------------------
+    # Recording
+    # -----------------------
+    def observe_request(self, endpoint: str, status, seconds: float, size: int = 0) -> None:
+        """Record one HTTP attempt, `status` is the status code or 'error'."""
+        with self._lock:
+            self.latency[endpoint].observe(seconds)
+            self.status_counts[endpoint][str(status)] += 1
+            self.counters[endpoint]['bytes'] += size
+
+    def record_retry(self, endpoint: str, backoff_seconds: float = 0.0) -> None:
+        """Record a retry and the backoff it imposed before the next attempt."""
+        with self._lock:
+            self.counters[endpoint]['retries'] += 1
+            self.counters[endpoint]['backoff_seconds'] += backoff_seconds
+
+    def record_rate_wait(self, endpoint: str, seconds: float) -> None:
+        """Record time spent waiting for a request slot of the rate limiters."""
+        with self._lock:
+            self.counters[endpoint]['rate_wait_seconds'] += seconds
+
+    def observe_write(self, collection_name: str, seconds: float, operations: int) -> None:
+        with self._lock:
+            self.write_latency[collection_name].observe(seconds)
+            self.write_operations[collection_name] += operations
+
+    def record_stages(self, endpoint: str, stages: dict) -> None:
+        """Keep the items per second of every pipeline stage of an endpoint crawl."""
+        with self._lock:
+            for stage, metrics in stages.items():
+                self.stage_throughput[(endpoint, stage)] = metrics.get('items_per_second') or 0.0
+
+    # -----------------------
+    # Export
+    # -----------------------
+    def summary(self) -> dict:
+        """JSON-serializable summary, e.g. to be pushed to XCom."""
+        with self._lock:
+            endpoints = {
+                endpoint: {
+                    'requests': self.latency[endpoint].count,
+                    'status_counts': dict(self.status_counts[endpoint]),
+                    'latency_seconds': self.latency[endpoint].snapshot(),
+                    **{key: round(value, 3) if isinstance(value, float) else value for key, value in counters.items()},
+                }
+                for endpoint, counters in self.counters.items()
+            }
+            writes = {}
+            for collection_name, histogram in self.write_latency.items():
+                writes[collection_name] = {
+                    'bulk_writes': histogram.count,
+                    'operations': self.write_operations[collection_name],
+                    'latency_seconds': histogram.snapshot(),
+                    'operations_per_second': round(self.write_operations[collection_name] / histogram.sum, 1) if histogram.sum else None,
+                }
+            stages = {f"{endpoint}.{stage}": value for (endpoint, stage), value in self.stage_throughput.items()}
+        return {'endpoints': endpoints, 'writes': writes, 'stage_items_per_second': stages}
+
+    def to_prometheus(self) -> str:
+        """Render every metric in the Prometheus text exposition format."""
+        lines = []
+
+        def label_str(**labels) -> str:
+            labels = {**self.labels, **labels}
+            return '{' + ','.join(f'{key}="{value}"' for key, value in labels.items()) + '}'
+
+        def histogram(name: str, help_text: str, histograms: dict, label: str):
+            lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} histogram"])
+            for key, hist in histograms.items():
+                for bound, count in zip(hist.buckets, hist.counts):
+                    lines.append(f"{name}_bucket{label_str(**{label: key, 'le': bound})} {count}")
+                lines.append(f"{name}_bucket{label_str(**{label: key, 'le': '+Inf'})} {hist.count}")
+                lines.append(f"{name}_sum{label_str(**{label: key})} {hist.sum}")
+                lines.append(f"{name}_count{label_str(**{label: key})} {hist.count}")
+
+        def counter(name: str, help_text: str, key: str):
+            lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} counter"])
+            for endpoint, counters in self.counters.items():
+                lines.append(f"{name}{label_str(endpoint=endpoint)} {counters[key]}")
+
+        with self._lock:
+            histogram('steam_request_duration_seconds', 'Latency of Steam HTTP attempts.', self.latency, 'endpoint')
+            lines.extend(["# HELP steam_requests_total Steam HTTP attempts by status.", "# TYPE steam_requests_total counter"])
+            for endpoint, statuses in self.status_counts.items():
+                for status, count in statuses.items():
+                    lines.append(f"steam_requests_total{label_str(endpoint=endpoint, status=status)} {count}")
+            counter('steam_retries_total', 'Retried Steam requests.', 'retries')
+            counter('steam_backoff_seconds_total', 'Backoff imposed by retries.', 'backoff_seconds')
+            counter('steam_rate_wait_seconds_total', 'Time spent waiting for a rate limiter slot.', 'rate_wait_seconds')
+            counter('steam_response_bytes_total', 'Bytes of Steam response bodies.', 'bytes')
+            histogram('mongo_bulk_write_duration_seconds', 'Latency of Mongo bulk writes.', self.write_latency, 'collection')
+            lines.extend(["# HELP mongo_bulk_write_operations_total Operations sent in bulk writes.", "# TYPE mongo_bulk_write_operations_total counter"])
+            for collection_name, operations in self.write_operations.items():
+                lines.append(f"mongo_bulk_write_operations_total{label_str(collection=collection_name)} {operations}")
+            lines.extend(["# HELP crawl_stage_items_per_second Items processed per second by pipeline stage.", "# TYPE crawl_stage_items_per_second gauge"])
+            for (endpoint, stage), value in self.stage_throughput.items():
+                lines.append(f"crawl_stage_items_per_second{label_str(endpoint=endpoint, stage=stage)} {value}")
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, name: str, directory: Optional[str] = None) -> Optional[str]:
+        """
+        Write the metrics to `<directory>/<name>.prom` for the node exporter
+        textfile collector (directory defaults to STEAM_METRICS_DIR, skipped if unset).
+        """
+        directory = directory or os.getenv('STEAM_METRICS_DIR')
+        if not directory:
+            return None
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{name}.prom")
+        # Write then rename so the collector never reads a partial file
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            file.write(self.to_prometheus())
+        os.replace(temp_path, path)
+        return path
@@ -1,8 +1,8 @@
-from typing import Any
+from typing import Any, Callable, Optional
 import difflib
 from bs4 import BeautifulSoup
 import unicodedata
-from collections import Counter
+from collections import Counter, OrderedDict
 import numpy as np
 import pandas as pd
 import polars as pl
@@ -51,6 +51,32 @@ def convert_mixed_columns_to_string(df: pd.DataFrame, sample_size: int = 1000) -
 
     return df
 
+def _flatten_struct_exprs(expr: pl.Expr, name: str, dtype: pl.DataType) -> list:
+    """Expressions selecting every non-struct leaf of a column under a dotted name."""
+    if isinstance(dtype, pl.Struct):
+        return [
+            leaf
+            for field in dtype.fields
+            for leaf in _flatten_struct_exprs(expr.struct.field(field.name), f"{name}.{field.name}", field.dtype)
+        ]
+    return [expr.alias(name)]
+
+def read_documents_df(documents: list, schema: dict) -> pl.LazyFrame:
+    """
+    Load Mongo documents into a LazyFrame with a declared nested schema.
+
+    Nested documents are flattened into dotted columns like `pd.json_normalize`
+    (lists are kept as lists). Polars coerces values of another type to the
+    declared dtype in the same pass (e.g. ints of a String column become
+    strings) and values that cannot be coerced, like [] for a struct, become null.
+    """
+    df = pl.from_dicts(documents, schema=schema, strict=False)
+    return df.lazy().select([
+        leaf
+        for name, dtype in schema.items()
+        for leaf in _flatten_struct_exprs(pl.col(name), name, dtype)
+    ])
+
 def to_pg_array_str_safe(value):
     """
     Converts a list of strings to a properly escaped PostgreSQL array literal.
@@ -65,6 +91,145 @@ def to_pg_array_str_safe(value):
 
     return "{" + ",".join(escape_pg_string(v) for v in value) + "}"
 
+def to_pg_array_str_expr(col: str) -> pl.Expr:
+    """Column-wise `to_pg_array_str_safe` for a List(String) column."""
+    quoted = pl.col(col).list.eval(
+        pl.concat_str([
+            pl.lit('"'),
+            pl.element().str.replace_all('\\', '\\\\', literal=True).str.replace_all('"', '\\"', literal=True),
+            pl.lit('"'),
+        ])
+    )
+    return pl.concat_str([pl.lit("{"), quoted.list.join(","), pl.lit("}")])
+
+def to_json_str_expr(col) -> pl.Expr:
+    """Compact JSON text of a column or expression, nulls stay null."""
+    expr = pl.col(col) if isinstance(col, str) else col
+    # json_encode only exists for structs, so the value is wrapped and unwrapped
+    wrapped = pl.struct(expr.alias("v")).struct.json_encode()
+    return pl.when(expr.is_not_null()).then(wrapped.str.strip_prefix('{"v":').str.strip_suffix("}"))
+
+def to_json_str_list_expr(col: str) -> pl.Expr:
+    """JSON text of a List(String) column laid out like json.dumps (', ' separators)."""
+    elements = pl.col(col).list.eval(
+        pl.when(pl.element().is_not_null())
+        .then(to_json_str_expr(pl.element()))
+        .otherwise(pl.lit("null"))
+    )
+    return pl.concat_str([pl.lit("["), elements.list.join(", "), pl.lit("]")])
+
+def encode_pg_columns_df(df: pl.LazyFrame, empty_list_as_null: bool = False, null_struct_as_null: bool = False) -> pl.LazyFrame:
+    """
+    Encode nested columns for Postgres in one pass, like the former per-row loop:
+    lists of strings become array literals (JSON if they hold nulls), empty lists
+    '{}' (or null), other lists and structs JSON text.
+    """
+    exprs = []
+    for col, dtype in df.collect_schema().items():
+        if isinstance(dtype, pl.List):
+            if dtype.inner == pl.String:
+                has_nulls = pl.col(col).list.eval(pl.element().is_null()).list.any()
+                expr = pl.when(has_nulls).then(to_json_str_list_expr(col)).otherwise(to_pg_array_str_expr(col))
+            else:
+                expr = to_json_str_expr(col)
+            is_empty = pl.col(col).list.len() == 0
+            expr = pl.when(is_empty).then(pl.lit(None if empty_list_as_null else "{}", dtype=pl.String)).otherwise(expr)
+        elif isinstance(dtype, pl.Struct):
+            expr = to_json_str_expr(col)
+            if null_struct_as_null:
+                all_null = pl.all_horizontal([pl.col(col).struct.field(field.name).is_null() for field in dtype.fields])
+                expr = pl.when(~all_null).then(expr)
+        else:
+            continue
+        exprs.append(expr.alias(col))
+    return df.with_columns(exprs)
+
+#--------------------------------------
+# Memoize Transforms
+#--------------------------------------
+class DistinctValueCache:
+    """
+    Bounded LRU cache of transform results, kept across batches. Values longer
+    than `max_value_length` are not cached (they are still deduplicated per batch).
+    """
+
+    def __init__(self, maxsize: int = 50_000, max_value_length: int = 4096):
+        self.maxsize = maxsize
+        self.max_value_length = max_value_length
+        self._entries = OrderedDict()
+        self.rows = 0
+        self.distinct = 0
+        self.hits = 0
+
+    def get(self, value, default=None):
+        if value in self._entries:
+            self._entries.move_to_end(value)
+            self.hits += 1
+            return self._entries[value]
+        return default
+
+    def put(self, value, result) -> None:
+        if isinstance(value, str) and len(value) > self.max_value_length:
+            return
+        self._entries[value] = result
+        self._entries.move_to_end(value)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def __contains__(self, value) -> bool:
+        return value in self._entries
+
+    def stats(self) -> dict:
+        """Share of rows served without calling the transform, and of distinct values served by the cache."""
+        computed = self.distinct - self.hits
+        return {
+            'rows': self.rows,
+            'computed': computed,
+            'row_hit_rate': round(1 - computed / self.rows, 4) if self.rows else None,
+            'cache_hit_rate': round(self.hits / self.distinct, 4) if self.distinct else None,
+            'size': len(self._entries),
+        }
+
+def map_distinct(
+    s: pl.Series,
+    func: Callable,
+    return_dtype: pl.DataType,
+    cache: Optional[DistinctValueCache] = None,
+    vectorized: bool = False,
+) -> pl.Series:
+    """
+    Apply `func` once per distinct non-null value of `s` and map the results back.
+    `func` takes a single value, or a Series of values if `vectorized`.
+    """
+    values = s.drop_nulls().unique().to_list()
+    results = {}
+    missing = []
+    for value in values:
+        if cache is not None and value in cache:
+            results[value] = cache.get(value)
+        else:
+            missing.append(value)
+
+    if missing:
+        if vectorized:
+            computed = func(pl.Series(missing, dtype=s.dtype)).to_list()
+        else:
+            computed = [func(value) for value in missing]
+        for value, result in zip(missing, computed):
+            results[value] = result
+            if cache is not None:
+                cache.put(value, result)
+
+    if cache is not None:
+        cache.rows += len(s) - s.null_count()
+        cache.distinct += len(values)
+
+    return s.replace_strict(
+        values,
+        pl.Series([results[value] for value in values], dtype=return_dtype),
+        default=None,
+        return_dtype=return_dtype,
+    )
 
 #--------------------------------------
 # Clean Strings
@@ -75,9 +240,64 @@ def remove_html_tags(text: str):
         return soup.get_text(separator=" ").strip()
     return text
 
-def remove_html_tags_df(df: pl.LazyFrame, cols: list) -> pl.LazyFrame:
+# Maximal runs of tags, comments, declarations and script/style elements.
+# BeautifulSoup joins the text nodes around any such run with a single separator.
+HTML_TAG_RUN_PATTERN = (
+    r"(?is)(?:"
+    r"<script\b[^>]*>.*?</script\s*>"
+    r"|<style\b[^>]*>.*?</style\s*>"
+    r"|<!--.*?-->"
+    r"|<![a-z][^>]*>"
+    r"|<\?[^>]*>"
+    r"|</?[a-z](?:[^>\"']|\"[^\"]*\"|'[^']*')*>"
+    r")+"
+)
+# Entities Steam markup uses the most, decoded exactly like html.parser does
+COMMON_HTML_ENTITIES = {
+    '&amp;': '&', '&lt;': '<', '&gt;': '>', '&quot;': '"', '&#39;': "'", '&#039;': "'", '&apos;': "'",
+    '&nbsp;': '\xa0', '&reg;': '®', '&trade;': '™', '&copy;': '©', '&ndash;': '–', '&mdash;': '—',
+    '&hellip;': '…', '&rsquo;': '’', '&lsquo;': '‘', '&ldquo;': '“', '&rdquo;': '”', '&bull;': '•',
+    '&middot;': '·', '&deg;': '°', '&times;': '×',
+}
+# Characters stripped by str.strip(), and the ASCII ones among them
+ASCII_WHITESPACE = '\t\n\x0b\x0c\r\x1c\x1d\x1e\x1f '
+PY_WHITESPACE = (
+    '\t\n\x0b\x0c\r\x1c\x1d\x1e\x1f \x85\xa0\u1680\u2000\u2001\u2002\u2003\u2004\u2005'
+    '\u2006\u2007\u2008\u2009\u200a\u2028\u2029\u202f\u205f\u3000'
+)
+
+def remove_html_tags_series(s: pl.Series) -> pl.Series:
+    """
+    Column-wise equivalent of `remove_html_tags`. Rows the fast path can't
+    reproduce exactly (rare entities, stray '<', CDATA, <pre>) go through BeautifulSoup.
+    """
+    # Mark every tag run with a \x01\x02 pair so whitespace-only text between two
+    # runs can be collapsed like BeautifulSoup does ('\n' if it holds one, else ' ')
+    marked = (
+        s.str.replace_all(HTML_TAG_RUN_PATTERN, "\x01\x02")
+        .str.replace_all(r"\x02[ \t\n\x0c\r]*\n[ \t\n\x0c\r]*\x01", "\x02\n\x01")
+        .str.replace_all(r"\x02[ \t\x0c\r]+\x01", "\x02 \x01")
+    )
+    entities, characters = list(COMMON_HTML_ENTITIES), list(COMMON_HTML_ENTITIES.values())
+    residual = (
+        s.str.contains(r"(?i)[\x00-\x02]|<(?:pre|textarea)\b")
+        | marked.str.replace_many(entities, [""] * len(entities)).str.contains(r"<|&[#a-zA-Z]")
+    ).fill_null(False)
+    result = (
+        marked.str.replace_many(["\x01", "\x02"] + entities, [" ", ""] + characters)
+        .str.strip_chars(PY_WHITESPACE)
+    )
+    if residual.any():
+        indices = residual.arg_true()
+        result = result.scatter(indices, [remove_html_tags(text) for text in s.gather(indices)])
+    return result
+
+def remove_html_tags_df(df: pl.LazyFrame, cols: list, cache: Optional[DistinctValueCache] = None) -> pl.LazyFrame:
     return df.with_columns([
-        pl.col(col).map_elements(remove_html_tags, return_dtype=pl.String).alias(col)
+        pl.col(col).map_batches(
+            lambda s: map_distinct(s, remove_html_tags_series, pl.String, cache=cache, vectorized=True),
+            return_dtype=pl.String,
+        ).alias(col)
         for col in cols
     ])
     
@@ -86,9 +306,23 @@ def normalize_strings(text: str) -> str:
         return unicodedata.normalize('NFKC', text).strip()
     return text
 
+def normalize_strings_series(s: pl.Series) -> pl.Series:
+    """
+    Column-wise equivalent of `normalize_strings`. NFKC leaves ASCII unchanged,
+    so only the non-ASCII rows are normalized in Python.
+    """
+    # An all-null column of a batch is inferred as Null
+    s = s.cast(pl.String)
+    result = s.str.strip_chars(ASCII_WHITESPACE)
+    non_ascii = (s.str.len_bytes() != s.str.len_chars()).fill_null(False)
+    if non_ascii.any():
+        indices = non_ascii.arg_true()
+        result = result.scatter(indices, [normalize_strings(text) for text in s.gather(indices)])
+    return result
+
 def normalize_strings_df(df: pl.LazyFrame, cols: list) -> pl.LazyFrame:
     return df.with_columns([
-        pl.col(col).map_elements(normalize_strings, return_dtype=pl.String).alias(col)
+        pl.col(col).cast(pl.String).map_batches(normalize_strings_series, return_dtype=pl.String).alias(col)
         for col in cols
     ])
     
@@ -137,6 +371,26 @@ def is_diff_texts(a: str, b: str) -> bool:
     diff = difflib.ndiff(a_lines, b_lines)
     return bool(any(line.startswith(('- ', '+ ')) for line in diff))
 
+# Line boundaries of str.splitlines()
+LINE_BREAK_PATTERN = r"\r\n|[\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029]"
+
+def _canonical_lines_expr(col: str) -> pl.Expr:
+    # Texts with equal canonical forms have equal splitlines(), except "" ([]) vs "\n" ([""])
+    return pl.col(col).fill_null("").str.replace_all(LINE_BREAK_PATTERN, "\n").str.strip_suffix("\n")
+
+def is_diff_texts_df(df: pl.LazyFrame, a: str, b: str, alias: str) -> pl.LazyFrame:
+    """
+    Column-wise equivalent of `is_diff_texts`: ndiff reports a change exactly
+    when the two line lists differ, so the texts are compared after
+    canonicalizing line breaks, in linear time.
+    """
+    return df.with_columns(
+        (
+            (_canonical_lines_expr(a) != _canonical_lines_expr(b))
+            | ((pl.col(a).fill_null("") == "") != (pl.col(b).fill_null("") == ""))
+        ).alias(alias)
+    )
+
 #--------------------------------------
 # Clean Descriptions
 #--------------------------------------
@@ -207,7 +461,7 @@ def parse_steam_review_score(review_score: str) -> dict:
     }
     return review_score_dict
 
-def parse_steam_review_score_df(df: pl.LazyFrame, col: str) -> pl.LazyFrame:
+def parse_steam_review_score_df(df: pl.LazyFrame, col: str, cache: Optional[DistinctValueCache] = None) -> pl.LazyFrame:
     review_struct = pl.Struct([
         pl.Field("review_sentiment", pl.String),
         pl.Field("review_score_text", pl.String),
@@ -215,6 +469,9 @@ def parse_steam_review_score_df(df: pl.LazyFrame, col: str) -> pl.LazyFrame:
     
     return df.with_columns([
         pl.col(col)
-        .map_elements(parse_steam_review_score, return_dtype=review_struct)
+        .map_batches(
+            lambda s: map_distinct(s, parse_steam_review_score, review_struct, cache=cache),
+            return_dtype=review_struct,
+        )
         .alias(col)
     ])
\ No newline at end of file
@@ -0,0 +1,35 @@
+from datetime import datetime
+
+import pytest
+
+from data_pipeline.managers.mongo_manager import (
+    NO_DETAILS_MAX_TRIES,
+    NO_DETAILS_RETRY_BASE,
+    MongoManager,
+)
+
+
+@pytest.fixture
+def mongo_manager():
+    # The client connects lazily, so nothing here reaches a server
+    return MongoManager(connection_string='mongodb://localhost:27017')
+
+
+#--------------------------------------
+# No Details
+#--------------------------------------
+def test_no_details_backoff_doubles_until_parked(mongo_manager):
+    tries, next_retry_at, is_parked = mongo_manager.no_details_backoff({'tries': 2})
+    assert (tries, is_parked) == (3, False)
+    assert next_retry_at - datetime.now() > NO_DETAILS_RETRY_BASE * 3
+
+    tries, _, is_parked = mongo_manager.no_details_backoff({'tries': NO_DETAILS_MAX_TRIES - 1})
+    assert (tries, is_parked) == (NO_DETAILS_MAX_TRIES, True)
+
+
+@pytest.mark.parametrize("legacy_tries", [21, 29, 1000])
+def test_no_details_backoff_legacy_tries(mongo_manager, legacy_tries):
+    # Counters of documents written before apps were parked kept growing
+    tries, next_retry_at, is_parked = mongo_manager.no_details_backoff({'tries': legacy_tries})
+    assert (tries, is_parked) == (legacy_tries + 1, True)
+    assert next_retry_at - datetime.now() <= NO_DETAILS_RETRY_BASE * 2 ** (NO_DETAILS_MAX_TRIES - 1)
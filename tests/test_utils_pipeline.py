@@ -0,0 +1,95 @@
+import random
+
+import polars as pl
+import pytest
+
+from data_pipeline.utils.utils_pipeline import (
+    is_diff_texts,
+    is_diff_texts_df,
+    normalize_strings,
+    normalize_strings_df,
+    normalize_strings_series,
+    remove_html_tags,
+    remove_html_tags_series,
+)
+
+#--------------------------------------
+# Clean Strings
+#--------------------------------------
+# Markup Steam emits, plus malformed input the fast path hands to BeautifulSoup
+HTML_FRAGMENTS = [
+    "<br>", "<br />", "<BR>", "<li>", "</li>", '<ul class="bb_ul">', "</ul>", "<p>", "</p>",
+    "<strong>", "</strong>", "<i>", "</i>", '<h2 class="bb_tag">', "</h2>", '<Span Style="a">', "</span>",
+    '<img src="https://x/y.gif?t=1">', '<a href="https://steamcommunity.com/linkfilter/?url=a&amp;b" target="_blank">', "</a>",
+    "<a title='x>y'>", "<!-- c -->", "<script>var a='<b>';</script>", "<style>p{}</style>",
+    "<!DOCTYPE html>", "<?x?>", "<![CDATA[z]]>", "</>", "<pre> a  b </pre>",
+    "&amp;", "&lt;", "&gt;", "&quot;", "&nbsp;", "&reg;", "&trade;", "&#39;", "&foo;", "&amp", "&#150;", "&#x41;",
+    " < ", "<3", "x>y", "\n", "\r\n", "\t", " ", "  ", "\xa0", "　",
+    "Hello", "world", "Ünïcödé", "日本語", "OS:", "Windows 10",
+]
+
+
+def random_html(rng: random.Random, max_fragments: int = 60) -> str:
+    return "".join(rng.choices(HTML_FRAGMENTS, k=rng.randint(0, max_fragments)))
+
+
+@pytest.mark.parametrize("text", [
+    "<p>a</p>\n<p>b</p>",
+    "a<br>\n\n <br>b",
+    "<ul><li>one</li><li>two</li></ul>",
+    "a<script>var x = '<b>';</script>b",
+    "a&foo;b &amp x &#150;",
+    "a <3 b",
+    "&lt;b&gt;",
+    "<br>",
+    "",
+])
+def test_remove_html_tags_series_matches_beautifulsoup(text):
+    assert remove_html_tags_series(pl.Series([text])).to_list() == [remove_html_tags(text)]
+
+
+def test_remove_html_tags_series_matches_beautifulsoup_fuzzed():
+    rng = random.Random(1)
+    texts = [random_html(rng) for _ in range(5000)] + [None]
+    assert remove_html_tags_series(pl.Series(texts, dtype=pl.String)).to_list() == [remove_html_tags(text) for text in texts]
+
+
+@pytest.mark.parametrize("text", [" plain ascii\t", "\x1c ascii separators \x1f", " ﬁ Ａ ① ", "　日本\xa0", "", None])
+def test_normalize_strings_series_matches_normalize_strings(text):
+    assert normalize_strings_series(pl.Series([text], dtype=pl.String)).to_list() == [normalize_strings(text)]
+
+
+def test_normalize_strings_df_all_null_column():
+    # A batch where every value is missing is inferred as a Null column
+    df = pl.LazyFrame([{'appid': 1, 'review_score': None}], strict=False)
+    assert df.pipe(normalize_strings_df, cols=['review_score']).collect()['review_score'].to_list() == [None]
+
+
+#--------------------------------------
+# Clean Descriptions
+#--------------------------------------
+# Every line boundary str.splitlines() knows
+LINE_FRAGMENTS = ["a", "b", " ", "\n", "\r\n", "\r", "\x0b", "\x0c", "\x1c", "\x1d", "\x1e", "\x85", "\u2028", "\u2029", "\n\n"]
+
+
+def diff_texts_df(pairs: list) -> list:
+    df = pl.LazyFrame({'a': [a for a, _ in pairs], 'b': [b for _, b in pairs]}, schema={'a': pl.String, 'b': pl.String})
+    return df.pipe(is_diff_texts_df, a='a', b='b', alias='has_diff').collect()['has_diff'].to_list()
+
+
+@pytest.mark.parametrize("a, b", [
+    (None, None), (None, ""), ("", "\n"), (None, "\n"), ("x", "x\n"), ("x\r\ny", "x\ny"),
+    ("\n\n", "\n"), ("a\nb", "b\na"), ("x\x85", "x"), ("x\u2028y", "x\ny"),
+])
+def test_is_diff_texts_df_matches_ndiff(a, b):
+    assert diff_texts_df([(a, b)]) == [is_diff_texts(a, b)]
+
+
+def test_is_diff_texts_df_matches_ndiff_fuzzed():
+    rng = random.Random(3)
+    pairs = []
+    for _ in range(5000):
+        a = "".join(rng.choices(LINE_FRAGMENTS, k=rng.randint(0, 6)))
+        b = rng.choice([a, a + rng.choice(["\n", "\r\n", "\n\n"]), "".join(rng.choices(LINE_FRAGMENTS, k=rng.randint(0, 6)))])
+        pairs.append((a, b))
+    assert diff_texts_df(pairs) == [is_diff_texts(a, b) for a, b in pairs]